@@ -4,7 +4,8 @@
 и поиска корректных ID для моделей в config.yaml
 """
 import os
-import requests
+import httpx
+import ijson
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения
@@ -22,54 +23,85 @@ headers = {
     'Authorization': f'Bearer {OPENROUTER_API_KEY}'
 }
 
+# Ищем нужные модели
+search_terms = {
+    'Gemini 3 Pro': ['gemini', '3', 'pro'],
+    'Claude Opus 4.5': ['claude', 'opus', '4.5'],
+    'Grok 4.1': ['grok', '4.1', '4'],
+    'ChatGPT 5.1': ['gpt', '5.1', '5', 'reasoning']
+}
+search_terms_lc = {
+    name: [term.lower() for term in terms]
+    for name, terms in search_terms.items()
+}
+
+
+def iter_models(response: httpx.Response):
+    """Потоковый разбор списка моделей из ответа API"""
+    events = ijson.sendable_list()
+    parser = ijson.items_coro(events, 'data.item')
+    for chunk in response.iter_bytes():
+        parser.send(chunk)
+        yield from events
+        del events[:]
+    parser.close()
+    yield from events
+
+
 try:
-    response = requests.get('https://openrouter.ai/api/v1/models', headers=headers)
-    response.raise_for_status()
+    found = {name: [] for name in search_terms}
+    first_models = []
+    total = 0
     
-    data = response.json()
-    models = data.get('data', [])
+    # Один клиент с пулом соединений и HTTP/2 на все запросы скрипта
+    with httpx.Client(http2=True, timeout=10.0) as client:
+        with client.stream('GET', 'https://openrouter.ai/api/v1/models', headers=headers) as response:
+            response.raise_for_status()
+            
+            # Один проход по потоку JSON: модели раскладываются по категориям сразу
+            for model in iter_models(response):
+                total += 1
+                model_id = model.get('id', '')
+                model_name = model.get('name', '')
+                mid = model_id.lower()
+                mnm = model_name.lower()
+                
+                # Проверяем, содержит ли модель ключевые слова
+                for category, terms_lc in search_terms_lc.items():
+                    if any(term in mid or term in mnm for term in terms_lc):
+                        found[category].append(
+                            (model_id, model_name, (model.get('description') or 'Нет описания')[:100])
+                        )
+                
+                if len(first_models) < 50:
+                    first_models.append((model_id, model_name))
     
-    print(f"✅ Найдено {len(models)} моделей\n")
+    print(f"✅ Найдено {total} моделей\n")
     print("=" * 80)
     
-    # Ищем нужные модели
-    search_terms = {
-        'Gemini 3 Pro': ['gemini', '3', 'pro'],
-        'Claude Opus 4.5': ['claude', 'opus', '4.5'],
-        'Grok 4.1': ['grok', '4.1', '4'],
-        'ChatGPT 5.1': ['gpt', '5.1', '5', 'reasoning']
-    }
-    
     print("\n🎯 ПОИСК НУЖНЫХ МОДЕЛЕЙ:\n")
     
-    for model_name, terms in search_terms.items():
+    for model_name, matches in found.items():
         print(f"\n{model_name}:")
         print("-" * 80)
         
-        found = False
-        for model in models:
-            model_id = model.get('id', '').lower()
-            model_display_name = model.get('name', '').lower()
-            
-            # Проверяем, содержит ли модель все ключевые слова
-            if any(term.lower() in model_id or term.lower() in model_display_name for term in terms):
-                print(f"  ID: {model.get('id')}")
-                print(f"  Название: {model.get('name')}")
-                print(f"  Описание: {model.get('description', 'Нет описания')[:100]}...")
-                print()
-                found = True
+        for model_id, display_name, description in matches:
+            print(f"  ID: {model_id}")
+            print(f"  Название: {display_name}")
+            print(f"  Описание: {description}...")
+            print()
         
-        if not found:
+        if not matches:
             print(f"  ⚠️ Модели не найдены. Попробуйте поискать вручную.")
     
     print("\n" + "=" * 80)
     print("\n📋 ВСЕ ДОСТУПНЫЕ МОДЕЛИ (первые 50):\n")
     
-    for i, model in enumerate(models[:50], 1):
-        print(f"{i}. {model.get('id')} - {model.get('name')}")
+    for i, (model_id, display_name) in enumerate(first_models, 1):
+        print(f"{i}. {model_id} - {display_name}")
     
-    if len(models) > 50:
-        print(f"\n... и еще {len(models) - 50} моделей")
+    if total > 50:
+        print(f"\n... и еще {total - 50} моделей")
     
     print("\n" + "=" * 80)
     print("\n💡 РЕКОМЕНДАЦИИ:\n")
@@ -79,7 +111,7 @@ try:
     print("4. Убедитесь, что на балансе достаточно средств")
     print("\n" + "=" * 80)
 
-except requests.exceptions.RequestException as e:
+except httpx.HTTPError as e:
     print(f"❌ Ошибка при запросе к OpenRouter API: {e}")
 except Exception as e:
     print(f"❌ Неожиданная ошибка: {e}")
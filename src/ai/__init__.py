@@ -1,6 +1,7 @@
 """AI модули для дебатов"""
 from .models import AIResponse, DebateRound, DebateSession
-from .openrouter_client import openrouter_client, OpenRouterClient
+from .openrouter_client import openrouter_client, OpenRouterClient, StreamInterruptedError
+from .cache import CachedClient, DebateCache, cached_client
 from .debate_manager import debate_manager, DebateManager
 
 __all__ = [
@@ -9,6 +10,10 @@ __all__ = [
     'DebateSession',
     'openrouter_client',
     'OpenRouterClient',
+    'StreamInterruptedError',
+    'CachedClient',
+    'DebateCache',
+    'cached_client',
     'debate_manager',
     'DebateManager'
 ]
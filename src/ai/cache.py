@@ -0,0 +1,337 @@
+"""
+Кэширование ответов AI моделей и завершенных дебатов
+"""
+import json
+import time
+import pickle
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+from typing import List, Dict, Optional, Any, Tuple, AsyncIterator
+
+from utils import config, log
+from ai.models import AIResponse, DebateSession
+from ai.openrouter_client import openrouter_client
+
+
+class CachedClient:
+    """
+    Обертка над OpenRouterClient с кэшем точных совпадений запросов
+    
+    Кэшируются только детерминированные запросы (температура не выше
+    max_temperature). Ключ - SHA-256 от модели, сообщений и параметров генерации.
+    """
+    
+    def __init__(
+        self,
+        client,
+        enabled: bool = True,
+        max_entries: int = 500,
+        ttl: int = 3600,
+        max_temperature: float = 0.0,
+        persist_dir: Optional[Path] = None
+    ):
+        self.client = client
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.persist_dir = persist_dir
+        
+        # key -> (время истечения, ответ в виде словаря)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+        
+        if self.persist_dir:
+            self.persist_dir.mkdir(parents=True, exist_ok=True)
+    
+    def __getattr__(self, name: str):
+        # Остальные методы клиента доступны без изменений
+        return getattr(self.client, name)
+    
+    @staticmethod
+    def _make_key(
+        model_key: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: Optional[int]
+    ) -> str:
+        """Ключ кэша для запроса"""
+        payload = json.dumps(
+            {
+                "model": model_key,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            },
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получить запись из памяти с учетом TTL"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, data = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        
+        self._entries.move_to_end(key)
+        return data
+    
+    def _put(self, key: str, data: Dict[str, Any], expires_at: float):
+        """Положить запись в память, вытесняя самые старые"""
+        self._entries[key] = (expires_at, data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    async def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Найти запись в памяти, затем в файловом кэше"""
+        data = self._get(key)
+        if data is None and self.persist_dir:
+            stored = await asyncio.to_thread(self._load_from_disk, key)
+            if stored is not None:
+                # Память меняется только в потоке event loop
+                expires_at, data = stored
+                self._put(key, data, expires_at)
+        return data
+    
+    def _load_from_disk(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """Прочитать запись из файлового кэша (выполняется в отдельном потоке)"""
+        filepath = self.persist_dir / f"{key}.json"
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"Ошибка чтения кэша {filepath}: {e}")
+            return None
+        
+        if stored['expires_at'] < time.time():
+            filepath.unlink(missing_ok=True)
+            return None
+        
+        return stored['expires_at'], stored['response']
+    
+    def _save_to_disk(self, key: str, data: Dict[str, Any], expires_at: float):
+        """Записать запись в файловый кэш"""
+        filepath = self.persist_dir / f"{key}.json"
+        try:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'response': data}, f, ensure_ascii=False)
+        except Exception as e:
+            log.warning(f"Ошибка записи кэша {filepath}: {e}")
+    
+    async def get_response(
+        self,
+        model_key: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        provider: Optional[Dict[str, Any]] = None
+    ) -> Optional[AIResponse]:
+        """
+        Получить ответ модели, используя кэш для детерминированных запросов
+        
+        Маршрутизация (provider) не влияет на ключ кэша: ответ модели не
+        зависит от того, какой провайдер его сгенерировал.
+        
+        Args:
+            model_key: Ключ модели из конфигурации
+            messages: Список сообщений
+            temperature: Температура (если None, берется из конфигурации)
+            max_tokens: Максимум токенов (если None, берется из конфигурации)
+            provider: Настройки маршрутизации OpenRouter
+        
+        Returns:
+            AIResponse или None
+        """
+        params = self.client.get_model_params(model_key) or {}
+        temp = temperature if temperature is not None else params.get('temperature', 0.2)
+        
+        if not self.enabled or temp > self.max_temperature:
+            return await self.client.get_response(model_key, messages, temperature, max_tokens, provider)
+        
+        key = self._make_key(model_key, messages, temp, max_tokens)
+        
+        data = await self._lookup(key)
+        
+        if data is not None:
+            self.stats["hits"] += 1
+            log.info(f"Ответ {model_key} взят из кэша")
+            return AIResponse(**data)
+        
+        self.stats["misses"] += 1
+        response = await self.client.get_response(model_key, messages, temperature, max_tokens, provider)
+        
+        if response:
+            await self._store(key, response)
+        
+        return response
+    
+    async def stream_response(
+        self,
+        model_key: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        usage: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Получать ответ модели по частям, используя кэш для детерминированных запросов
+        
+        Ответ из кэша отдается одним фрагментом. Поток сохраняется в кэш так же,
+        как ответ get_response, только если он завершился событием со
+        статистикой токенов; оборванный поток поднимает StreamInterruptedError
+        и в кэш не попадает.
+        
+        Args:
+            model_key: Ключ модели из конфигурации
+            messages: Список сообщений
+            temperature: Температура (если None, берется из конфигурации)
+            max_tokens: Максимум токенов (если None, берется из конфигурации)
+            usage: Словарь, в который записывается статистика токенов
+        
+        Yields:
+            Очередные фрагменты текста ответа
+        """
+        params = self.client.get_model_params(model_key) or {}
+        temp = temperature if temperature is not None else params.get('temperature', 0.2)
+        usage = usage if usage is not None else {}
+        
+        if not self.enabled or temp > self.max_temperature:
+            async for chunk in self.client.stream_response(model_key, messages, temperature, max_tokens, usage):
+                yield chunk
+            return
+        
+        key = self._make_key(model_key, messages, temp, max_tokens)
+        
+        data = await self._lookup(key)
+        
+        if data is not None:
+            self.stats["hits"] += 1
+            log.info(f"Ответ {model_key} взят из кэша")
+            if data.get('tokens_used') is not None:
+                usage['total_tokens'] = data['tokens_used']
+            yield data['content']
+            return
+        
+        self.stats["misses"] += 1
+        chunks: List[str] = []
+        async for chunk in self.client.stream_response(model_key, messages, temperature, max_tokens, usage):
+            chunks.append(chunk)
+            yield chunk
+        
+        # Без последнего события со статистикой полнота ответа не подтверждена
+        if chunks and usage:
+            response = self.client.make_response(model_key, ''.join(chunks), usage.get('total_tokens'))
+            await self._store(key, response)
+    
+    async def _store(self, key: str, response: AIResponse):
+        """Сохранить ответ в кэш (в памяти и на диске)"""
+        # Время ответа не кэшируем
+        data = asdict(response)
+        del data['timestamp']
+        expires_at = time.time() + self.ttl
+        self._put(key, data, expires_at)
+        if self.persist_dir:
+            await asyncio.to_thread(self._save_to_disk, key, data, expires_at)
+
+
+class DebateCache:
+    """
+    Файловый кэш завершенных дебатов
+    
+    Ключ - SHA-256 от нормализованного вопроса, режима и набора моделей.
+    Сессии хранятся в pickle (data/debate_cache/{key}.pkl), срок жизни
+    определяется по времени изменения файла.
+    """
+    
+    def __init__(self, cache_dir: Path, enabled: bool = True, ttl: int = 86400):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.ttl = ttl
+        
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+    
+    @staticmethod
+    def _make_key(question: str, mode: str, model_keys: List[str]) -> str:
+        """Ключ кэша для дебатов"""
+        normalized = ' '.join(question.lower().split())
+        payload = '\x00'.join([normalized, mode, *sorted(model_keys)])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _load(self, filepath: Path) -> Optional[DebateSession]:
+        """Прочитать сессию из файла (выполняется в отдельном потоке)"""
+        try:
+            if filepath.stat().st_mtime + self.ttl < time.time():
+                filepath.unlink(missing_ok=True)
+                return None
+            with open(filepath, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"Ошибка чтения кэша дебатов {filepath}: {e}")
+            return None
+    
+    def _store(self, filepath: Path, session: DebateSession):
+        """Записать сессию в файл (выполняется в отдельном потоке)"""
+        try:
+            with open(filepath, 'wb') as f:
+                pickle.dump(session, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            log.warning(f"Ошибка записи кэша дебатов {filepath}: {e}")
+    
+    async def get_cached(
+        self,
+        question: str,
+        mode: str,
+        model_keys: List[str]
+    ) -> Optional[DebateSession]:
+        """
+        Найти завершенные дебаты по тому же вопросу
+        
+        Args:
+            question: Вопрос для дебатов
+            mode: Режим дебатов
+            model_keys: Список моделей
+        
+        Returns:
+            DebateSession или None
+        """
+        if not self.enabled:
+            return None
+        
+        filepath = self.cache_dir / f"{self._make_key(question, mode, model_keys)}.pkl"
+        return await asyncio.to_thread(self._load, filepath)
+    
+    async def put_cached(self, session: DebateSession, model_keys: List[str]):
+        """Сохранить завершенные дебаты в кэш"""
+        if not self.enabled:
+            return
+        
+        filepath = self.cache_dir / f"{self._make_key(session.question, session.mode, model_keys)}.pkl"
+        await asyncio.to_thread(self._store, filepath, session)
+
+
+_llm_cache_config = config.llm_cache
+
+# Глобальный клиент с кэшем ответов (общий для дебатов и вопросов одной модели)
+cached_client = CachedClient(
+    openrouter_client,
+    enabled=_llm_cache_config.get('enabled', False),
+    max_entries=_llm_cache_config.get('max_entries', 500),
+    ttl=_llm_cache_config.get('ttl', 3600),
+    max_temperature=_llm_cache_config.get('max_temperature', 0.0),
+    persist_dir=config.base_dir / "data" / "llm_cache" if _llm_cache_config.get('persist') else None
+)
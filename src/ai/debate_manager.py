@@ -2,25 +2,62 @@
 Менеджер дебатов между AI моделями v2.0
 С интеграцией Гарвардской методики и MIT Multi-Agent Debate
 """
+import io
 import uuid
-import json
-import time
-from typing import List, Dict, Optional
-from datetime import datetime
+import pickle
+import asyncio
+import statistics
+from typing import AsyncIterator, Callable, List, Dict, Optional, Set
 from pathlib import Path
 
 from utils import config, log
 from ai.models import AIResponse, DebateRound, DebateSession
-from ai.openrouter_client import openrouter_client
+from ai.cache import DebateCache, cached_client
 
 
 class DebateManagerV2:
     """Управление процессом дебатов между AI моделями с разделением ролей"""
     
+    _UNKNOWN_MODEL_CTX = {'name': 'Unknown', 'role': 'Unknown', 'spec': '', 'color': '⚪'}
+    
+    # Раунды, в которых модели отвечают на сам вопрос
+    _ANSWER_ROUND_TYPES = frozenset({
+        'independent_generation', 'improvement', 'improvement_and_synthesis', 'consensus_building'
+    })
+    
     def __init__(self):
-        self.client = openrouter_client
-        self.debates_dir = Path(__file__).parent.parent.parent / "data" / "debates"
+        data_dir = Path(__file__).parent.parent.parent / "data"
+        
+        self.client = cached_client
+        self.debate_cache = DebateCache(
+            data_dir / "debate_cache",
+            enabled=config.debate_cache.get('enabled', False),
+            ttl=config.debate_cache.get('ttl', 86400)
+        )
+        
+        self.debates_dir = data_dir / "debates"
         self.debates_dir.mkdir(parents=True, exist_ok=True)
+        self._debug = config.settings.log_level.upper() == 'DEBUG'
+        
+        # Предельное время ответа одной модели в раунде (с учетом повторов)
+        self._model_deadline = config.openrouter.get('model_deadline')
+        
+        # Дублирование медленных запросов (время ответа моделей ведет клиент)
+        self._hedging = config.hedging
+        
+        # Прямые ссылки на разделы конфигурации для горячих путей
+        self._p = config.prompts
+        self._m = config.models
+        
+        # Фрагменты промптов для каждой модели зависят только от конфигурации
+        self._model_ctx = self._build_model_ctx()
+        
+        # Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+        self._background_tasks: Set[asyncio.Task] = set()
+        
+        # Очередь сохранения дебатов и ее фоновый писатель
+        self._save_queue: Optional[asyncio.Queue] = None
+        self._save_worker_task: Optional[asyncio.Task] = None
     
     async def start_debate(
         self,
@@ -41,11 +78,44 @@ class DebateManagerV2:
         Returns:
             DebateSession с результатами
         """
-        start_time = time.time()
+        session = None
+        async for session in self.stream_debate(user_id, question, mode, model_keys):
+            pass
+        return session
+    
+    async def stream_debate(
+        self,
+        user_id: int,
+        question: str,
+        mode: str = 'standard',
+        model_keys: Optional[List[str]] = None
+    ) -> AsyncIterator[DebateSession]:
+        """
+        Провести дебаты, отдавая сессию после каждого раунда
+        
+        Args:
+            user_id: ID пользователя Telegram
+            question: Вопрос для дебатов
+            mode: Режим дебатов (quick, standard, deep)
+            model_keys: Список моделей (если None, используются все)
+            
+        Yields:
+            DebateSession после очередного раунда; последней отдается
+            завершенная сессия (completed_at заполнен)
+        """
+        # Определяем модели для дебатов
+        if model_keys is None:
+            model_keys = list(self._m.keys())
+        
+        cached = await self.debate_cache.get_cached(question, mode, model_keys)
+        if cached is not None:
+            log.info(f"Дебаты по вопросу '{question[:50]}...' взяты из кэша ({cached.session_id})")
+            yield cached.reuse_for(user_id, question)
+            return
         
         # Создаем сессию
         session_id = str(uuid.uuid4())
-        debate_mode = config.debate_modes.get(mode, config.debate_modes['standard'])
+        debate_mode = config.get_debate_mode(mode)
         
         session = DebateSession(
             session_id=session_id,
@@ -54,17 +124,23 @@ class DebateManagerV2:
             mode=mode
         )
         
-        # Определяем модели для дебатов
-        if model_keys is None:
-            model_keys = list(config.models.keys())
+        # Системный промпт одинаков для всех запросов дебатов
+        system_prompt = self._p['system_base']
         
         log.info(
             f"Начало дебатов {session_id}: вопрос='{question[:50]}...', "
-            f"режим={mode}, раундов={debate_mode['rounds']}, модели={model_keys}"
+            f"режим={mode}, раундов={debate_mode.rounds}, модели={model_keys}"
         )
         
+        # Последний раунд, где модели отвечали на вопрос (а не критиковали
+        # или синтезировали): по нему проверяется консенсус
+        answer_round: Optional[DebateRound] = None
+        final_synthesis_round: Optional[DebateRound] = None
+        # Все ли модели ответили в каждом раунде (неполные дебаты не кэшируются)
+        all_models_answered = True
+        
         # Выполняем раунды согласно структуре режима
-        for round_info in debate_mode['structure']:
+        for round_info in debate_mode.structure:
             round_num = round_info['round']
             round_type = round_info['type']
             
@@ -72,76 +148,108 @@ class DebateManagerV2:
             
             if round_type == 'independent_generation':
                 debate_round = await self._run_independent_generation(
-                    question, model_keys, round_num
+                    question, model_keys, round_num, system_prompt
                 )
             elif round_type == 'mutual_critique':
                 debate_round = await self._run_mutual_critique(
-                    question, model_keys, round_num, session.rounds[-1].responses
+                    question, model_keys, round_num, session.rounds[-1], system_prompt
                 )
             elif round_type == 'critique_and_synthesis':
                 debate_round = await self._run_critique_and_synthesis(
-                    question, model_keys, round_num, session.rounds[-1].responses
+                    question, model_keys, round_num, session.rounds[-1], system_prompt
                 )
             elif round_type == 'improvement':
                 debate_round = await self._run_improvement(
-                    question, model_keys, round_num, session.rounds
+                    question, model_keys, round_num, session.rounds, system_prompt
                 )
             elif round_type == 'improvement_and_synthesis':
                 debate_round = await self._run_improvement_and_synthesis(
-                    question, model_keys, round_num, session.rounds
+                    question, model_keys, round_num, session.rounds, system_prompt
                 )
             elif round_type == 'consensus_building':
                 debate_round = await self._run_consensus_building(
-                    question, model_keys, round_num, session.rounds
+                    question, model_keys, round_num, session.rounds, system_prompt
                 )
             elif round_type == 'final_synthesis':
+                if answer_round and self._consensus_answer(answer_round.responses):
+                    log.info("Модели сошлись, финальный синтез не запрашивается")
+                    continue
                 debate_round = await self._run_final_synthesis(
-                    question, round_num, session
+                    question, round_num, session, system_prompt
                 )
+                final_synthesis_round = debate_round
             else:
                 log.warning(f"Неизвестный тип раунда: {round_type}")
                 continue
             
+            if round_type in self._ANSWER_ROUND_TYPES:
+                answer_round = debate_round
+            if round_type != 'final_synthesis':
+                answered = {r.model_key for r in debate_round.responses if r is not debate_round.synthesis}
+                all_models_answered = all_models_answered and answered.issuperset(model_keys)
+            
+            debate_round.formatted = self._format_responses_for_context(debate_round.responses)
             session.add_round(debate_round)
+            session.log_formatted_round(debate_round)
+            yield session
         
         # Финальный синтез (если еще не был выполнен)
-        if debate_mode['structure'][-1]['type'] != 'final_synthesis':
-            final_answer, final_confidence = await self._synthesize_final_answer(
-                question, session
-            )
-        else:
-            # Берем результат последнего раунда
-            last_response = session.rounds[-1].responses[0]  # ChatGPT синтез
+        if session.rounds[-1].synthesis is not None:
+            # Синтез уже получен в последнем раунде (*_and_synthesis)
+            final_answer = session.rounds[-1].synthesis.content
+            final_confidence = session.rounds[-1].synthesis.confidence or 85.0
+        elif final_synthesis_round is not None:
+            # Берем результат раунда финального синтеза
+            last_response = final_synthesis_round.responses[0]  # ChatGPT синтез
             final_answer = last_response.content
             final_confidence = last_response.confidence or 85.0
+        else:
+            # Синтеза не было: модели сошлись или запрос синтеза не удался
+            final_answer, final_confidence = await self._synthesize_final_answer(
+                question, session, system_prompt, answer_round
+            )
         
         # Завершаем сессию
-        elapsed_time = int(time.time() - start_time)
+        elapsed_time = session.elapsed_seconds()
         session.complete(final_answer, final_confidence)
         
-        # Подсчет токенов
-        total_tokens = sum(
-            response.tokens_used or 0
-            for round_data in session.rounds
-            for response in round_data.responses
-        )
-        session.total_tokens = total_tokens
-        
-        # Сохраняем дебаты
+        # Сохраняем дебаты в фоне, не задерживая ответ пользователю
         self._save_debate(session)
+        if all_models_answered and not (session.synthesis_skipped or session.synthesis_fallback):
+            self._run_in_background(self.debate_cache.put_cached(session, model_keys))
         
         log.info(
             f"Дебаты {session_id} завершены: "
-            f"уверенность={final_confidence}%, токенов={total_tokens}, время={elapsed_time}с"
+            f"уверенность={final_confidence}%, токенов={session.total_tokens}, время={elapsed_time}с, "
+            f"кэш LLM: попаданий={self.client.stats['hits']}, промахов={self.client.stats['misses']}"
         )
         
-        return session
+        yield session
+    
+    def _run_in_background(self, coro):
+        """Запустить корутину в фоне, сохранив ссылку на задачу"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    def _build_model_ctx(self) -> Dict[str, Dict[str, str]]:
+        """Предвычислить фрагменты промптов для каждой модели"""
+        return {
+            model_key: {
+                'name': model_config.name,
+                'role': getattr(model_config, 'role', 'Analyst'),
+                'spec': ', '.join(getattr(model_config, 'specialization', [])),
+                'color': getattr(model_config, 'color', '⚪')
+            }
+            for model_key, model_config in self._m.items()
+        }
     
     async def _run_independent_generation(
         self,
         question: str,
         model_keys: List[str],
-        round_num: int
+        round_num: int,
+        system_prompt: str
     ) -> DebateRound:
         """
         Раунд 1: Независимая генерация ответов
@@ -149,34 +257,25 @@ class DebateManagerV2:
         """
         log.info(f"Раунд {round_num}: Независимая генерация от {len(model_keys)} моделей")
         
-        responses = []
-        
-        for model_key in model_keys:
-            model_config = config.models[model_key]
-            role = model_config.get('role', 'Analyst')
-            specialization = ', '.join(model_config.get('specialization', []))
+        def build_messages(model_key: str) -> List[Dict[str, str]]:
+            ctx = self._model_ctx[model_key]
             
             # Формируем промпт с учетом роли
-            system_prompt = config.prompts['system_base']
-            round_prompt = config.prompts['round_1_independent'].format(
-                role=role,
-                specialization=specialization,
+            round_prompt = self._p['round_1_independent'].format(
+                role=ctx['role'],
+                specialization=ctx['spec'],
                 question=question
             )
             
-            messages = [
+            return [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": round_prompt}
             ]
-            
-            response = await self.client.get_response(
-                model_key=model_key,
-                messages=messages
-            )
-            
-            if response:
-                responses.append(response)
-                log.info(f"  {model_config['name']}: уверенность {response.confidence}%")
+        
+        responses = await self._fanout(model_keys, build_messages)
+        
+        for response in responses:
+            log.info(f"  {response.model_name}: уверенность {response.confidence}%")
         
         return DebateRound(round_number=round_num, responses=responses)
     
@@ -185,7 +284,8 @@ class DebateManagerV2:
         question: str,
         model_keys: List[str],
         round_num: int,
-        previous_responses: List[AIResponse]
+        previous_round: DebateRound,
+        system_prompt: str
     ) -> DebateRound:
         """
         Раунд 2: Взаимная критика
@@ -193,36 +293,12 @@ class DebateManagerV2:
         """
         log.info(f"Раунд {round_num}: Взаимная критика")
         
-        # Форматируем предыдущие ответы
-        other_responses_text = self._format_responses_for_context(previous_responses)
-        
-        responses = []
+        responses = await self._fanout(
+            model_keys, self._critique_messages(previous_round, system_prompt)
+        )
         
-        for model_key in model_keys:
-            model_config = config.models[model_key]
-            role = model_config.get('role', 'Analyst')
-            specialization = ', '.join(model_config.get('specialization', []))
-            
-            system_prompt = config.prompts['system_base']
-            round_prompt = config.prompts['round_2_critique'].format(
-                role=role,
-                specialization=specialization,
-                other_responses=other_responses_text
-            )
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": round_prompt}
-            ]
-            
-            response = await self.client.get_response(
-                model_key=model_key,
-                messages=messages
-            )
-            
-            if response:
-                responses.append(response)
-                log.info(f"  {model_config['name']}: критика предоставлена")
+        for response in responses:
+            log.info(f"  {response.model_name}: критика предоставлена")
         
         return DebateRound(round_number=round_num, responses=responses)
     
@@ -231,25 +307,44 @@ class DebateManagerV2:
         question: str,
         model_keys: List[str],
         round_num: int,
-        previous_responses: List[AIResponse]
+        previous_round: DebateRound,
+        system_prompt: str
     ) -> DebateRound:
         """
         Раунд 2 (быстрый режим): Критика и синтез в одном раунде
         """
         log.info(f"Раунд {round_num}: Критика и синтез")
         
-        # Сначала критика
-        critique_round = await self._run_mutual_critique(
-            question, model_keys, round_num, previous_responses
+        # Ответы критики форматируются по мере поступления
+        critique_by_key = {}
+        formatted_by_key = {}
+        
+        async for response in self._iter_fanout(
+            model_keys, self._critique_messages(previous_round, system_prompt)
+        ):
+            critique_by_key[response.model_key] = response
+            formatted_by_key[response.model_key] = self._format_response(response)
+            log.info(f"  {response.model_name}: критика предоставлена")
+        
+        critique_round = DebateRound(
+            round_number=round_num,
+            responses=[critique_by_key[k] for k in model_keys if k in critique_by_key]
         )
         
-        # Затем синтез (только ChatGPT)
-        all_data = self._format_all_responses([
-            previous_responses,
-            critique_round.responses
-        ])
+        # Ответы раунда 1 уже сошлись: финальный ответ берется из них без синтеза
+        if self._consensus_answer(previous_round.responses):
+            return critique_round
+        
+        # Текст собирается в порядке model_keys, а не завершения запросов:
+        # промпт синтеза одинаков при одинаковых ответах
+        buf = io.StringIO()
+        buf.write("=== ЭТАП 1 ===\n\n")
+        buf.write(previous_round.formatted)
+        buf.write("\n\n=== ЭТАП 2 ===\n\n")
+        buf.write("\n".join(formatted_by_key[k] for k in model_keys if k in formatted_by_key))
+        all_data = buf.getvalue()
         
-        system_prompt = config.prompts['system_base']
+        # Затем синтез (только ChatGPT)
         synthesis_prompt = f"""
         Проанализируй все ответы и критику. Синтезируй финальный ответ.
         
@@ -271,6 +366,7 @@ class DebateManagerV2:
         
         if synthesis_response:
             critique_round.responses.append(synthesis_response)
+            critique_round.synthesis = synthesis_response
         
         return critique_round
     
@@ -279,56 +375,20 @@ class DebateManagerV2:
         question: str,
         model_keys: List[str],
         round_num: int,
-        previous_rounds: List[DebateRound]
+        previous_rounds: List[DebateRound],
+        system_prompt: str
     ) -> DebateRound:
         """
         Раунд 3: Улучшение на основе критики
         """
         log.info(f"Раунд {round_num}: Улучшение ответов")
         
-        # Получаем начальные ответы и критику
-        initial_responses = previous_rounds[0].responses
-        critique_responses = previous_rounds[1].responses
-        
-        responses = []
+        responses = await self._fanout(
+            model_keys, self._improvement_messages(previous_rounds, system_prompt)
+        )
         
-        for model_key in model_keys:
-            model_config = config.models[model_key]
-            role = model_config.get('role', 'Analyst')
-            specialization = ', '.join(model_config.get('specialization', []))
-            
-            # Находим свой предыдущий ответ
-            your_previous = next(
-                (r for r in initial_responses if r.model_key == model_key),
-                None
-            )
-            
-            # Собираем критику от других
-            critique_received = self._format_responses_for_context([
-                r for r in critique_responses if r.model_key != model_key
-            ])
-            
-            system_prompt = config.prompts['system_base']
-            round_prompt = config.prompts['round_3_improvement'].format(
-                role=role,
-                specialization=specialization,
-                your_previous_response=your_previous.content if your_previous else "Нет предыдущего ответа",
-                critique_received=critique_received
-            )
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": round_prompt}
-            ]
-            
-            response = await self.client.get_response(
-                model_key=model_key,
-                messages=messages
-            )
-            
-            if response:
-                responses.append(response)
-                log.info(f"  {model_config['name']}: ответ улучшен")
+        for response in responses:
+            log.info(f"  {response.model_name}: ответ улучшен")
         
         return DebateRound(round_number=round_num, responses=responses)
     
@@ -337,22 +397,43 @@ class DebateManagerV2:
         question: str,
         model_keys: List[str],
         round_num: int,
-        previous_rounds: List[DebateRound]
+        previous_rounds: List[DebateRound],
+        system_prompt: str
     ) -> DebateRound:
         """
         Раунд 3 (стандартный режим): Улучшение и финальный синтез
         """
         log.info(f"Раунд {round_num}: Улучшение и синтез")
         
-        # Сначала улучшение
-        improvement_round = await self._run_improvement(
-            question, model_keys, round_num, previous_rounds
+        # Улучшенные ответы форматируются по мере поступления
+        improved_by_key = {}
+        formatted_by_key = {}
+        
+        async for response in self._iter_fanout(
+            model_keys, self._improvement_messages(previous_rounds, system_prompt)
+        ):
+            improved_by_key[response.model_key] = response
+            formatted_by_key[response.model_key] = self._format_response(response)
+            log.info(f"  {response.model_name}: ответ улучшен")
+        
+        improvement_round = DebateRound(
+            round_number=round_num,
+            responses=[improved_by_key[k] for k in model_keys if k in improved_by_key]
         )
         
-        # Затем синтез всех данных
-        all_rounds_data = self._format_all_rounds(previous_rounds + [improvement_round])
+        # Улучшенные ответы сошлись: финальный ответ берется из них без синтеза
+        if self._consensus_answer(improvement_round.responses):
+            return improvement_round
+        
+        # Текст собирается в порядке model_keys, а не завершения запросов:
+        # промпт синтеза одинаков при одинаковых ответах
+        buf = io.StringIO()
+        self._format_all_rounds(previous_rounds, buf)
+        buf.write(f"\n\n=== РАУНД {round_num} ===\n\n")
+        buf.write("\n".join(formatted_by_key[k] for k in model_keys if k in formatted_by_key))
+        all_rounds_data = buf.getvalue()
         
-        system_prompt = config.prompts['system_base']
+        # Затем синтез всех данных
         synthesis_prompt = f"""
         Синтезируй финальный ответ на основе всех раундов дебатов.
         
@@ -374,6 +455,7 @@ class DebateManagerV2:
         
         if synthesis_response:
             improvement_round.responses.append(synthesis_response)
+            improvement_round.synthesis = synthesis_response
         
         return improvement_round
     
@@ -382,44 +464,35 @@ class DebateManagerV2:
         question: str,
         model_keys: List[str],
         round_num: int,
-        previous_rounds: List[DebateRound]
+        previous_rounds: List[DebateRound],
+        system_prompt: str
     ) -> DebateRound:
         """
         Раунд 4: Поиск консенсуса
         """
         log.info(f"Раунд {round_num}: Поиск консенсуса")
         
-        # Получаем улучшенные ответы
-        improved_responses = previous_rounds[-1].responses
-        all_improved_text = self._format_responses_for_context(improved_responses)
+        # Улучшенные ответы уже отформатированы в предыдущем раунде
+        all_improved_text = previous_rounds[-1].formatted
         
-        responses = []
-        
-        for model_key in model_keys:
-            model_config = config.models[model_key]
-            role = model_config.get('role', 'Analyst')
-            specialization = ', '.join(model_config.get('specialization', []))
+        def build_messages(model_key: str) -> List[Dict[str, str]]:
+            ctx = self._model_ctx[model_key]
             
-            system_prompt = config.prompts['system_base']
-            round_prompt = config.prompts['round_4_consensus'].format(
-                role=role,
-                specialization=specialization,
+            round_prompt = self._p['round_4_consensus'].format(
+                role=ctx['role'],
+                specialization=ctx['spec'],
                 all_improved_responses=all_improved_text
             )
             
-            messages = [
+            return [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": round_prompt}
             ]
-            
-            response = await self.client.get_response(
-                model_key=model_key,
-                messages=messages
-            )
-            
-            if response:
-                responses.append(response)
-                log.info(f"  {model_config['name']}: консенсус предложен")
+        
+        responses = await self._fanout(model_keys, build_messages)
+        
+        for response in responses:
+            log.info(f"  {response.model_name}: консенсус предложен")
         
         return DebateRound(round_number=round_num, responses=responses)
     
@@ -427,7 +500,8 @@ class DebateManagerV2:
         self,
         question: str,
         round_num: int,
-        session: DebateSession
+        session: DebateSession,
+        system_prompt: str
     ) -> DebateRound:
         """
         Раунд 5: Финальный синтез (только ChatGPT 5.1)
@@ -435,22 +509,13 @@ class DebateManagerV2:
         log.info(f"Раунд {round_num}: Финальный синтез (ChatGPT 5.1)")
         
         # Собираем все данные дебатов
-        all_debate_data = self._format_all_rounds(session.rounds)
-        
-        total_tokens = sum(
-            r.tokens_used or 0
-            for round_data in session.rounds
-            for r in round_data.responses
-        )
-        
-        elapsed_time = int(time.time() - session.started_at.timestamp())
+        all_debate_data = session.get_formatted_log()
         
-        system_prompt = config.prompts['system_base']
-        synthesis_prompt = config.prompts['round_5_synthesis'].format(
+        synthesis_prompt = self._p['round_5_synthesis'].format(
             all_debate_data=all_debate_data,
             rounds=len(session.rounds),
-            time=elapsed_time,
-            tokens=total_tokens
+            time=session.elapsed_seconds(),
+            tokens=session.total_tokens
         )
         
         messages = [
@@ -469,21 +534,32 @@ class DebateManagerV2:
         else:
             log.error("Не удалось получить финальный синтез")
             # Fallback
+            session.synthesis_fallback = True
             return session.rounds[-1]
     
     async def _synthesize_final_answer(
         self,
         question: str,
-        session: DebateSession
+        session: DebateSession,
+        system_prompt: str,
+        answer_round: Optional[DebateRound] = None
     ) -> tuple[str, float]:
         """
         Синтезировать финальный ответ (fallback метод)
+        
+        Args:
+            answer_round: Последний раунд с ответами моделей на вопрос; консенсус
+                и запасной лучший ответ берутся только из него, а не из критики
         """
-        log.info("Синтез финального ответа (fallback)")
+        converged = self._consensus_answer(answer_round.responses) if answer_round else None
+        if converged is not None:
+            session.synthesis_skipped = True
+            log.info(f"Модели сошлись (уверенность {converged[1]}%), синтез пропущен")
+            return converged
         
-        all_responses_text = self._format_all_rounds(session.rounds)
+        log.info("Синтез финального ответа (fallback)")
         
-        system_prompt = config.prompts['system_base']
+        all_responses_text = session.get_formatted_log()
         
         messages = [
             {"role": "system", "content": system_prompt},
@@ -498,86 +574,364 @@ class DebateManagerV2:
         if synthesis_response:
             return synthesis_response.content, synthesis_response.confidence or 85.0
         else:
-            # Берем лучший ответ из последнего раунда
-            last_round = session.rounds[-1]
+            # Берем лучший ответ из последнего раунда с ответами
+            session.synthesis_fallback = True
+            last_round = answer_round or session.rounds[-1]
             best_response = max(
                 last_round.responses,
                 key=lambda r: r.confidence or 0
             )
             return best_response.content, best_response.confidence or 80.0
     
-    def _format_responses_for_context(self, responses: List[AIResponse]) -> str:
-        """Форматировать ответы для контекста"""
-        formatted = []
-        for response in responses:
-            model_config = config.models.get(response.model_key, {})
-            role = model_config.get('role', 'Unknown')
-            color = model_config.get('color', '⚪')
+    def _consensus_answer(self, responses: List[AIResponse]) -> Optional[tuple[str, float]]:
+        """
+        Лучший из ответов, если все модели уверены и их оценки близки
+        
+        Вызывается до запроса синтеза, чтобы не тратить на него лишний вызов
+        
+        Returns:
+            (ответ, уверенность) или None, если консенсуса нет
+        """
+        consensus_config = config.consensus
+        if not consensus_config.get('enabled', False):
+            return None
+        
+        confidences = [r.confidence for r in responses if r.confidence]
+        if len(confidences) < 2 or len(confidences) != len(responses):
+            return None
+        
+        if (
+            min(confidences) < consensus_config.get('min_confidence', 85)
+            or max(confidences) - min(confidences) > consensus_config.get('max_gap', 5)
+        ):
+            return None
+        
+        best = max(responses, key=lambda r: r.confidence)
+        return best.content, best.confidence
+    
+    def _critique_messages(
+        self,
+        previous_round: DebateRound,
+        system_prompt: str
+    ) -> Callable[[str], List[Dict[str, str]]]:
+        """Построитель сообщений для раунда взаимной критики"""
+        # Предыдущие ответы уже отформатированы по завершении раунда
+        other_responses_text = previous_round.formatted
+        
+        def build_messages(model_key: str) -> List[Dict[str, str]]:
+            ctx = self._model_ctx[model_key]
             
-            formatted.append(
-                f"{color} **{response.model_name}** ({role}):\n"
-                f"{response.content}\n"
-                f"Уверенность: {response.confidence}%\n"
+            round_prompt = self._p['round_2_critique'].format(
+                role=ctx['role'],
+                specialization=ctx['spec'],
+                other_responses=other_responses_text
             )
-        return "\n".join(formatted)
+            
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": round_prompt}
+            ]
+        
+        return build_messages
     
-    def _format_all_responses(self, response_lists: List[List[AIResponse]]) -> str:
-        """Форматировать несколько списков ответов"""
-        result = []
-        for i, responses in enumerate(response_lists, 1):
-            result.append(f"=== ЭТАП {i} ===")
-            result.append(self._format_responses_for_context(responses))
-        return "\n\n".join(result)
+    def _improvement_messages(
+        self,
+        previous_rounds: List[DebateRound],
+        system_prompt: str
+    ) -> Callable[[str], List[Dict[str, str]]]:
+        """Построитель сообщений для раунда улучшения ответов"""
+        # Получаем начальные ответы и критику
+        initial_by_key = {r.model_key: r for r in previous_rounds[0].responses}
+        # Каждая критика форматируется один раз и входит в промпты всех остальных моделей
+        critique_formatted = [
+            (r.model_key, self._format_response(r)) for r in previous_rounds[1].responses
+        ]
+        
+        def build_messages(model_key: str) -> List[Dict[str, str]]:
+            ctx = self._model_ctx[model_key]
+            
+            # Находим свой предыдущий ответ
+            your_previous = initial_by_key.get(model_key)
+            
+            # Собираем критику от других
+            critique_received = "\n".join(
+                text for author, text in critique_formatted if author != model_key
+            )
+            
+            round_prompt = self._p['round_3_improvement'].format(
+                role=ctx['role'],
+                specialization=ctx['spec'],
+                your_previous_response=your_previous.content if your_previous else "Нет предыдущего ответа",
+                critique_received=critique_received
+            )
+            
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": round_prompt}
+            ]
+        
+        return build_messages
     
-    def _format_all_rounds(self, rounds: List[DebateRound]) -> str:
-        """Форматировать все раунды"""
-        result = []
-        for round_data in rounds:
-            result.append(f"=== РАУНД {round_data.round_number} ===")
-            result.append(self._format_responses_for_context(round_data.responses))
-        return "\n\n".join(result)
+    async def _request(
+        self,
+        model_key: str,
+        messages: List[Dict[str, str]]
+    ) -> Optional[AIResponse]:
+        """Запрос к модели, не пробрасывающий исключения наружу"""
+        try:
+            return await asyncio.wait_for(
+                self._hedged_response(model_key, messages),
+                timeout=self._model_deadline
+            )
+        except asyncio.TimeoutError:
+            log.error(f"  {model_key}: нет ответа за {self._model_deadline} с, модель пропущена")
+            return None
+        except Exception as e:
+            log.error(f"  {model_key}: ошибка запроса: {e}")
+            return None
     
-    def _save_debate(self, session: DebateSession):
-        """Сохранить дебаты в JSON"""
+    async def _hedged_response(
+        self,
+        model_key: str,
+        messages: List[Dict[str, str]]
+    ) -> Optional[AIResponse]:
+        """
+        Запрос к модели с дублем, если ответ задерживается
+        
+        Если модель не ответила за _hedge_delay, тот же запрос отправляется
+        еще раз через провайдеров из hedge_providers модели и берется
+        первый успешный ответ; оставшийся запрос отменяется.
+        """
+        tasks = [asyncio.create_task(self.client.get_response(model_key=model_key, messages=messages))]
         try:
-            filename = f"{session.session_id}_{session.user_id}.json"
-            filepath = self.debates_dir / filename
+            delay = self._hedge_delay(model_key)
+            if delay is None:
+                return await tasks[0]
             
-            # Преобразуем в словарь
-            debate_data = {
-                'session_id': session.session_id,
-                'user_id': session.user_id,
-                'question': session.question,
-                'mode': session.mode,
-                'started_at': session.started_at.isoformat(),
-                'completed_at': session.completed_at.isoformat() if session.completed_at else None,
-                'final_answer': session.final_answer,
-                'final_confidence': session.final_confidence,
-                'total_tokens': session.total_tokens,
-                'rounds': [
-                    {
-                        'round_number': r.round_number,
-                        'responses': [
-                            {
-                                'model_key': resp.model_key,
-                                'model_name': resp.model_name,
-                                'content': resp.content,
-                                'confidence': resp.confidence,
-                                'tokens_used': resp.tokens_used
-                            }
-                            for resp in r.responses
-                        ]
-                    }
-                    for r in session.rounds
-                ]
-            }
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
             
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(debate_data, f, ensure_ascii=False, indent=2)
+            log.info(f"  {model_key}: нет ответа за {delay:.1f} с, отправлен дублирующий запрос")
+            provider = {"order": self._m[model_key].hedge_providers}
+            tasks.append(asyncio.create_task(
+                self.client.get_response(model_key=model_key, messages=messages, provider=provider)
+            ))
             
-            log.info(f"Дебаты сохранены: {filepath}")
-        except Exception as e:
-            log.error(f"Ошибка сохранения дебатов: {e}")
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    response = await next_done
+                except Exception as e:
+                    log.warning(f"  {model_key}: ошибка одного из запросов: {e}")
+                    continue
+                if response:
+                    return response
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def _hedge_delay(self, model_key: str) -> Optional[float]:
+        """Через сколько секунд дублировать запрос к модели (None - не дублировать)"""
+        if not self._hedging.get('enabled', False):
+            return None
+        
+        # Дубль по тому же маршруту лишь оплачивает запрос дважды
+        if not getattr(self._m.get(model_key), 'hedge_providers', None):
+            return None
+        
+        # Замеры только сетевых запросов: ответы из кэша их не искажают
+        samples = self.client.recent_latencies(model_key)
+        if len(samples) < self._hedging.get('min_samples', 3):
+            return self._hedging.get('initial_delay', 60)
+        return self._hedging.get('delay_factor', 1.5) * statistics.median(samples)
+    
+    async def _iter_fanout(
+        self,
+        model_keys: List[str],
+        build_messages_for: Callable[[str], List[Dict[str, str]]]
+    ) -> AsyncIterator[AIResponse]:
+        """
+        Параллельно опросить несколько моделей, отдавая ответы по мере готовности
+        
+        Args:
+            model_keys: Список ключей моделей
+            build_messages_for: Функция, формирующая сообщения для модели по ключу
+            
+        Yields:
+            Успешные ответы в порядке завершения запросов
+        """
+        # Имя задачи - ключ модели: видно в отладке и при отмене
+        tasks = [
+            asyncio.create_task(self._request(model_key, build_messages_for(model_key)), name=model_key)
+            for model_key in model_keys
+        ]
+        
+        try:
+            for future in asyncio.as_completed(tasks):
+                response = await future
+                if response:
+                    yield response
+        finally:
+            # Если потребитель прервал итерацию, не оставляем висящих запросов
+            for task in tasks:
+                task.cancel()
+    
+    async def _fanout(
+        self,
+        model_keys: List[str],
+        build_messages_for: Callable[[str], List[Dict[str, str]]]
+    ) -> List[AIResponse]:
+        """
+        Параллельно опросить несколько моделей
+        
+        Args:
+            model_keys: Список ключей моделей
+            build_messages_for: Функция, формирующая сообщения для модели по ключу
+            
+        Returns:
+            Успешные ответы в порядке model_keys
+        """
+        by_key = {
+            response.model_key: response
+            async for response in self._iter_fanout(model_keys, build_messages_for)
+        }
+        return [by_key[k] for k in model_keys if k in by_key]
+    
+    def _format_response(self, response: AIResponse) -> str:
+        """Форматировать один ответ для контекста"""
+        ctx = self._model_ctx.get(response.model_key, self._UNKNOWN_MODEL_CTX)
+        
+        return (
+            f"{ctx['color']} **{response.model_name}** ({ctx['role']}):\n"
+            f"{response.content}\n"
+            f"Уверенность: {response.confidence}%\n"
+        )
+    
+    def _format_responses_for_context(
+        self,
+        responses: List[AIResponse],
+        buf: Optional[io.StringIO] = None
+    ) -> str:
+        """
+        Форматировать ответы для контекста
+        
+        Если передан buf, текст дополнительно дописывается в него
+        """
+        text = "\n".join(self._format_response(response) for response in responses)
+        if buf is not None:
+            buf.write(text)
+        return text
+    
+    def _format_all_rounds(
+        self,
+        rounds: List[DebateRound],
+        buf: Optional[io.StringIO] = None
+    ) -> str:
+        """
+        Форматировать все раунды
+        
+        Если передан buf, текст дополнительно дописывается в него
+        """
+        out = io.StringIO()
+        for i, round_data in enumerate(rounds):
+            if i:
+                out.write("\n\n")
+            out.write(f"=== РАУНД {round_data.round_number} ===\n\n")
+            if round_data.formatted is not None:
+                out.write(round_data.formatted)
+            else:
+                self._format_responses_for_context(round_data.responses, out)
+        
+        text = out.getvalue()
+        if buf is not None:
+            buf.write(text)
+        return text
+    
+    def _save_debate(self, session: DebateSession):
+        """Поставить дебаты в очередь на сохранение"""
+        # Очередь и писатель привязаны к текущему event loop
+        if self._save_worker_task is None or self._save_worker_task.done():
+            self._save_queue = asyncio.Queue()
+            self._save_worker_task = asyncio.create_task(self._save_worker())
+        self._save_queue.put_nowait(session)
+    
+    async def _save_worker(self):
+        """Фоновый писатель: накопившиеся сессии записываются одним заходом в поток"""
+        queue = self._save_queue
+        while True:
+            sessions = [await queue.get()]
+            while not queue.empty():
+                sessions.append(queue.get_nowait())
+            
+            try:
+                await asyncio.to_thread(self._write_debates, sessions)
+            except Exception as e:
+                log.error(f"Ошибка сохранения дебатов: {e}")
+            finally:
+                for _ in sessions:
+                    queue.task_done()
+    
+    async def wait_saved(self):
+        """Дождаться записи всех дебатов из очереди и в кэш дебатов (при остановке бота)"""
+        if self._save_worker_task is not None and not self._save_worker_task.done():
+            await self._save_queue.join()
+            # Писатель ждет очередь бесконечно: останавливаем его сами
+            self._save_worker_task.cancel()
+            await asyncio.gather(self._save_worker_task, return_exceptions=True)
+            self._save_worker_task = None
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+    
+    def _write_debates(self, sessions: List[DebateSession]):
+        """Записать сессии в pickle (и в JSON для отладки), выполняется в отдельном потоке"""
+        for session in sessions:
+            try:
+                filepath = self.debates_dir / f"{session.archive_name}.pkl"
+                filepath.write_bytes(pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL))
+                log.info(f"Дебаты сохранены: {filepath}")
+                
+                # Человекочитаемая копия нужна только при отладке
+                if self._debug:
+                    filepath = filepath.with_suffix('.json')
+                    filepath.write_bytes(session.to_json(indent=True))
+                    log.debug(f"JSON-копия дебатов: {filepath}")
+            except Exception as e:
+                log.error(f"Ошибка сохранения дебатов {session.session_id}: {e}")
+    
+    def format_debate_for_user(self, session: DebateSession) -> str:
+        """
+        Форматировать результаты дебатов для отображения пользователю
+        
+        Args:
+            session: Сессия дебатов
+            
+        Returns:
+            Отформатированный текст
+        """
+        separator = "=" * 50 + "\n\n"
+        elapsed = (session.completed_at - session.started_at).total_seconds() if session.completed_at else 0.0
+        
+        parts = [
+            f"🎯 **Вопрос:** {session.question}\n\n",
+            f"📊 **Режим:** {session.mode} ({len(session.rounds)} раундов)\n",
+            f"⏱ **Время:** {elapsed:.1f} сек\n",
+            f"🔢 **Токенов использовано:** {session.total_tokens}\n\n",
+            separator,
+            f"✅ **ФИНАЛЬНЫЙ ОТВЕТ** (Уверенность: {session.final_confidence}%)\n\n",
+            f"{session.final_answer}\n\n",
+            separator,
+            "📝 **ДЕТАЛИ ДЕБАТОВ:**\n\n"
+        ]
+        
+        for round_data in session.rounds:
+            parts.append(f"**Раунд {round_data.round_number}:**\n\n")
+            for response in round_data.responses:
+                color = getattr(self._m.get(response.model_key), 'color', '⚪')
+                conf = f" ({response.confidence}%)" if response.confidence else ""
+                parts.append(f"{color} **{response.model_name}**{conf}:\n{response.content[:300]}...\n\n")
+        
+        return ''.join(parts)
 
 
 # Глобальный экземпляр менеджера
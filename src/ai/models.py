@@ -1,60 +1,125 @@
 """
 Модели данных для AI дебатов
 """
+import io
+import time
+from dataclasses import dataclass, field, fields, asdict, replace
 from typing import List, Optional, Dict, Any
 from datetime import datetime
-from pydantic import BaseModel, Field
+import msgspec
+import orjson
 
 
-class AIResponse(BaseModel):
+@dataclass(slots=True)
+class AIResponse:
     """Ответ от AI модели"""
     model_key: str
     model_name: str
     content: str
     confidence: Optional[float] = None  # 0-100%
-    timestamp: datetime = Field(default_factory=datetime.now)
+    # Время ответа не фиксируется для каждой модели: его дает DebateRound.timestamp
+    timestamp: Optional[datetime] = None
     tokens_used: Optional[int] = None
-    
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
 
 
-class DebateRound(BaseModel):
+@dataclass(slots=True)
+class DebateRound:
     """Раунд дебатов"""
     round_number: int
-    responses: List[AIResponse] = []
+    responses: List[AIResponse] = field(default_factory=list)
     summary: Optional[str] = None
-    timestamp: datetime = Field(default_factory=datetime.now)
+    timestamp: datetime = field(default_factory=datetime.now)
+    # Синтез, выполненный в самом раунде (раунды *_and_synthesis); он же
+    # последним стоит в responses
+    synthesis: Optional[AIResponse] = None
+    # Ответы раунда в виде контекста для следующих раундов (заполняется по завершении).
+    # Это кэш отрисовки: в JSON (поле с "_") и в pickle (__getstate__) не попадает
+    _formatted: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    
+    @property
+    def formatted(self) -> Optional[str]:
+        """Отформатированные ответы раунда (None, если еще не заполнены)"""
+        return self._formatted
+    
+    @formatted.setter
+    def formatted(self, value: Optional[str]):
+        self._formatted = value
+    
+    def __getstate__(self):
+        """Состояние для pickle без кэша отрисовки"""
+        return (self.round_number, self.responses, self.summary, self.timestamp, self.synthesis)
     
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
+    def __setstate__(self, state):
+        self.round_number, self.responses, self.summary, self.timestamp, self.synthesis = state
+        self._formatted = None
 
 
-class DebateSession(BaseModel):
+@dataclass(slots=True)
+class DebateSession:
     """Сессия дебатов"""
     session_id: str
     user_id: int
     question: str
     mode: str  # quick, standard, deep
-    rounds: List[DebateRound] = []
+    rounds: List[DebateRound] = field(default_factory=list)
     final_answer: Optional[str] = None
     final_confidence: Optional[float] = None
-    started_at: datetime = Field(default_factory=datetime.now)
+    started_at: datetime = field(default_factory=datetime.now)
     completed_at: Optional[datetime] = None
     total_tokens: int = 0
+    # Финальный синтез не запрашивался: модели сошлись в последнем раунде
+    synthesis_skipped: bool = False
+    # Синтез не удался: финальный ответ - лучший ответ модели
+    synthesis_fallback: bool = False
     
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
+    # Отформатированный текст всех раундов, дописывается по мере их завершения.
+    # Нужен только во время дебатов: в JSON и в pickle (__getstate__) не попадает
+    _formatted_log: io.StringIO = field(default_factory=io.StringIO, init=False, repr=False, compare=False)
+    # Момент начала по монотонным часам: имеет смысл только в этом процессе,
+    # поэтому в JSON и pickle не попадает
+    _started_monotonic: float = field(default_factory=time.monotonic, init=False, repr=False, compare=False)
+    
+    def __getstate__(self):
+        """Состояние для pickle без журнала раундов"""
+        return {f.name: getattr(self, f.name) for f in fields(self) if not f.name.startswith('_')}
+    
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._formatted_log = io.StringIO()
+        self._started_monotonic = time.monotonic()
     
     def add_round(self, round_data: DebateRound):
         """Добавить раунд дебатов"""
         self.rounds.append(round_data)
+        self.total_tokens += sum(r.tokens_used or 0 for r in round_data.responses)
+    
+    def log_formatted_round(self, round_data: DebateRound):
+        """Дописать отформатированный раунд в журнал дебатов"""
+        if self._formatted_log.tell():
+            self._formatted_log.write("\n\n")
+        self._formatted_log.write(f"=== РАУНД {round_data.round_number} ===\n\n")
+        self._formatted_log.write(round_data.formatted or '')
+    
+    @property
+    def archive_name(self) -> str:
+        """Имя файла архива без расширения: сортируется по времени начала"""
+        return f"{self.started_at:%Y%m%d_%H%M%S}_{self.session_id}_{self.user_id}"
+    
+    def reuse_for(self, user_id: int, question: str) -> "DebateSession":
+        """
+        Копия сессии для другого запроса (ответ из кэша дебатов)
+        
+        Исходная сессия из кэша не меняется; в копии - текущий пользователь
+        и вопрос в той формулировке, в которой он задан сейчас.
+        """
+        session = replace(self, user_id=user_id, question=question)
+        session._formatted_log.write(self.get_formatted_log())
+        return session
+    
+    def get_formatted_log(self) -> str:
+        """Отформатированный текст всех завершенных раундов"""
+        return self._formatted_log.getvalue()
     
     def complete(self, final_answer: str, confidence: float):
         """Завершить сессию дебатов"""
@@ -62,28 +127,35 @@ class DebateSession(BaseModel):
         self.final_confidence = confidence
         self.completed_at = datetime.now()
     
+    def elapsed_seconds(self) -> int:
+        """Время с начала дебатов в секундах (по монотонным часам)"""
+        return int(time.monotonic() - self._started_monotonic)
+    
     def to_dict(self) -> Dict[str, Any]:
         """Преобразовать в словарь"""
-        return self.model_dump()
-
-
-class OpenRouterRequest(BaseModel):
-    """Запрос к OpenRouter API"""
-    model: str
-    messages: List[Dict[str, str]]
-    temperature: float = 0.2
-    max_tokens: int = 4096
-    top_p: float = 1.0
-    frequency_penalty: float = 0.0
-    presence_penalty: float = 0.0
+        data = asdict(self)
+        del data['_formatted_log']
+        del data['_started_monotonic']
+        for round_data in data['rounds']:
+            del round_data['_formatted']
+        return data
+    
+    def to_json(self, indent: bool = False) -> bytes:
+        """
+        Сериализовать в JSON за один проход, без промежуточного словаря
+        
+        orjson обходит dataclass напрямую; поля с "_" (журнал раундов) пропускаются.
+        """
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(self, option=option)
 
 
-class OpenRouterResponse(BaseModel):
-    """Ответ от OpenRouter API"""
+class OpenRouterResponse(msgspec.Struct):
+    """Ответ от OpenRouter API (декодируется msgspec напрямую из тела ответа)"""
     id: str
     model: str
     choices: List[Dict[str, Any]]
-    usage: Optional[Dict[str, int]] = None
+    usage: Optional[Dict[str, Any]] = None
     
     def get_content(self) -> str:
         """Получить текст ответа"""
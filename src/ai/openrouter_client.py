@@ -1,11 +1,34 @@
 """
 Клиент для работы с OpenRouter API
 """
+import re
+import time
+import random
 import aiohttp
 import asyncio
-from typing import List, Dict, Optional
+import msgspec
+import orjson
+from collections import deque
+from typing import Any, AsyncIterator, List, Dict, Optional
 from utils import config, log
-from ai.models import OpenRouterRequest, OpenRouterResponse, AIResponse
+from ai.models import OpenRouterResponse, AIResponse
+from ai.rate_limiter import RateLimiter
+
+
+# Шаблоны уверенности в порядке приоритета: сначала "Уверенность: 85%" /
+# "Confidence: 85%", и только без них - "85% уверенности" / "85% confidence"
+# (такую форму модель может процитировать из чужого ответа)
+_CONF_PATTERNS = (
+    re.compile(r'(?:[Уу]веренность|[Cc]onfidence)[:\s]+(\d+)%'),
+    re.compile(r'(\d+)%\s+(?:[уУ]веренност|[cC]onfiden)'),
+)
+
+# Декодер событий SSE при потоковой генерации
+_sse_decoder = msgspec.json.Decoder()
+
+
+class StreamInterruptedError(Exception):
+    """Потоковый ответ модели не дошел до конца (ошибка API или обрыв соединения)"""
 
 
 class OpenRouterClient:
@@ -17,6 +40,15 @@ class OpenRouterClient:
         self.timeout = config.openrouter['timeout']
         self.retry_attempts = config.openrouter['retry_attempts']
         self.retry_delay = config.openrouter['retry_delay']
+        self.max_retry_after = config.openrouter.get('max_retry_after', 30)
+        self.prompt_caching = config.openrouter.get('prompt_caching', False)
+        self.prompt_cache_min_chars = config.openrouter.get('prompt_cache_min_chars', 4096)
+        self.max_connections = config.openrouter.get('max_connections', 64)
+        self.keepalive_timeout = config.openrouter.get('keepalive_timeout', 60)
+        
+        # Ограничение параллельных запросов и частоты обращений к API
+        self._sem = asyncio.Semaphore(config.openrouter.get('max_concurrent_llm_calls', 8))
+        self._rate_limiter = RateLimiter(config.openrouter.get('requests_per_minute'))
         
         self.headers = {
             'Authorization': f'Bearer {self.api_key}',
@@ -24,6 +56,107 @@ class OpenRouterClient:
             'HTTP-Referer': 'https://github.com/telegram-ai-debate-bot',
             'X-Title': 'Telegram AI Debate Bot'
         }
+        
+        # Общая HTTP-сессия: соединения и TLS переиспользуются между запросами
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # model_key -> параметры модели с подставленными значениями по умолчанию
+        self._model_params: Dict[str, Dict[str, Any]] = {}
+        
+        # Неизменные части тела запроса для каждого набора параметров модели
+        self._req_templates: Dict[tuple, Dict[str, Any]] = {}
+        
+        # Текст системного промпта -> сообщение с пометкой cache_control
+        self._system_messages: Dict[str, Dict[str, Any]] = {}
+        
+        # model_id -> время последних успешных запросов (для дублирования медленных)
+        self._latency_window = config.hedging.get('window', 20)
+        self._latencies: Dict[str, deque] = {}
+    
+    def get_model_params(self, model_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Параметры запроса для модели (вычисляются один раз на ключ)
+        
+        Returns:
+            Словарь с id, name, temperature, max_tokens, reasoning, verbosity
+            или None, если модели нет в конфигурации
+        """
+        params = self._model_params.get(model_key)
+        if params is None:
+            model_config = config.get_model_config(model_key)
+            if not model_config:
+                return None
+            params = {
+                'id': model_config.id,
+                'name': model_config.name,
+                'temperature': getattr(model_config, 'temperature', 0.2),
+                'max_tokens': getattr(model_config, 'max_tokens', 8192),
+                'reasoning': getattr(model_config, 'reasoning', 'high'),
+                'verbosity': getattr(model_config, 'verbosity', 'high')
+            }
+            self._model_params[model_key] = params
+        return params
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Получить общую HTTP-сессию (создается лениво внутри event loop)"""
+        if self._session is None or self._session.closed:
+            # Все запросы идут на один хост: лимит пула и есть лимит на хост
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,
+                ttl_dns_cache=300,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers,
+                json_serialize=self._json_dumps
+            )
+        return self._session
+    
+    @staticmethod
+    def _json_dumps(obj: Any) -> str:
+        """Сериализация тела запроса через orjson (вместо стандартного json)"""
+        return orjson.dumps(obj).decode('utf-8')
+    
+    async def close(self):
+        """Закрыть HTTP-сессию (вызывается при остановке бота)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    def _build_request(
+        self,
+        model_id: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        reasoning: str,
+        verbosity: str
+    ) -> Dict[str, Any]:
+        """Собрать тело запроса из шаблона модели и сообщений"""
+        # Подготовка данных запроса с reasoning параметрами
+        if self.prompt_caching:
+            messages = self._with_prompt_cache(messages)
+        
+        template_key = (model_id, temperature, max_tokens, reasoning, verbosity)
+        template = self._req_templates.get(template_key)
+        if template is None:
+            template = {
+                "model": model_id,
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            }
+            
+            # Добавляем reasoning параметры если модель поддерживает
+            if reasoning:
+                template["reasoning_effort"] = reasoning
+            if verbosity:
+                template["verbosity"] = verbosity
+            self._req_templates[template_key] = template
+        
+        return {**template, "messages": messages}
     
     async def _make_request(
         self,
@@ -32,7 +165,8 @@ class OpenRouterClient:
         temperature: float = 0.2,
         max_tokens: int = 4096,
         reasoning: str = "high",
-        verbosity: str = "high"
+        verbosity: str = "high",
+        provider: Optional[Dict[str, Any]] = None
     ) -> Optional[OpenRouterResponse]:
         """
         Выполнить запрос к OpenRouter API
@@ -42,53 +176,50 @@ class OpenRouterClient:
             messages: Список сообщений для модели
             temperature: Температура генерации
             max_tokens: Максимальное количество токенов
+            provider: Настройки маршрутизации OpenRouter (например, порядок провайдеров)
             
         Returns:
             Ответ от API или None в случае ошибки
         """
-        # Подготовка данных запроса с reasoning параметрами
-        request_dict = {
-            "model": model_id,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens
-        }
-        
-        # Добавляем reasoning параметры если модель поддерживает
-        if reasoning:
-            request_dict["reasoning_effort"] = reasoning
-        if verbosity:
-            request_dict["verbosity"] = verbosity
-        
-        request_data = OpenRouterRequest(
-            model=model_id,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        request_dict = self._build_request(model_id, messages, temperature, max_tokens, reasoning, verbosity)
+        if provider:
+            request_dict["provider"] = provider
         
         url = f"{self.base_url}/chat/completions"
         
         for attempt in range(self.retry_attempts):
+            # Экспоненциальная задержка; для 429/503 ее может заменить Retry-After
+            delay = self.retry_delay * (2 ** attempt)
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        url,
-                        json=request_dict,
-                        headers=self.headers,
-                        timeout=aiohttp.ClientTimeout(total=self.timeout)
-                    ) as response:
+                # Слот и токен берутся на каждую попытку: ожидание между
+                # попытками не занимает место других запросов
+                async with self._sem:
+                    await self._rate_limiter.acquire()
+                    session = await self._get_session()
+                    started = time.monotonic()
+                    async with session.post(url, json=request_dict) as response:
                         if response.status == 200:
-                            data = await response.json()
+                            raw = await response.read()
+                            self._record_latency(model_id, time.monotonic() - started)
                             log.info(f"Успешный запрос к модели {model_id}")
-                            return OpenRouterResponse(**data)
-                        else:
-                            error_text = await response.text()
-                            log.error(
-                                f"Ошибка API (попытка {attempt + 1}/{self.retry_attempts}): "
-                                f"статус {response.status}, текст: {error_text}"
-                            )
-                            
+                            return msgspec.json.decode(raw, type=OpenRouterResponse)
+                        
+                        error_text = await response.text()
+                        log.error(
+                            f"Ошибка API (попытка {attempt + 1}/{self.retry_attempts}): "
+                            f"статус {response.status}, текст: {error_text}"
+                        )
+                        
+                        # Ошибки клиента (400, 401, 404...) повторять бессмысленно
+                        if response.status != 429 and response.status < 500:
+                            return None
+                        
+                        retry_after = self._parse_retry_after(
+                            response.headers.get('Retry-After'), self.max_retry_after
+                        )
+                        if retry_after is not None:
+                            delay = retry_after
+                        
             except asyncio.TimeoutError:
                 log.error(
                     f"Таймаут запроса к {model_id} "
@@ -100,18 +231,53 @@ class OpenRouterClient:
                     f"(попытка {attempt + 1}/{self.retry_attempts})"
                 )
             
-            # Ждем перед следующей попыткой
+            # Ждем перед следующей попыткой (со случайным разбросом, чтобы
+            # параллельные запросы не повторялись одновременно)
             if attempt < self.retry_attempts - 1:
-                await asyncio.sleep(self.retry_delay)
+                await asyncio.sleep(delay + random.uniform(0, 0.5))
         
         return None
     
+    def _record_latency(self, model_id: str, elapsed: float):
+        """Запомнить время успешного запроса к модели (без ожидания слота и повторов)"""
+        window = self._latencies.get(model_id)
+        if window is None:
+            window = self._latencies[model_id] = deque(maxlen=self._latency_window)
+        window.append(elapsed)
+    
+    def recent_latencies(self, model_key: str) -> List[float]:
+        """
+        Время последних успешных запросов к модели по сети, в секундах
+        
+        Ответы из кэша сюда не попадают: замер идет внутри _make_request.
+        """
+        params = self.get_model_params(model_key)
+        if not params:
+            return []
+        return list(self._latencies.get(params['id'], ()))
+    
+    @staticmethod
+    def _parse_retry_after(value: Optional[str], limit: float) -> Optional[float]:
+        """
+        Задержка из заголовка Retry-After в секундах (формат HTTP-даты не поддерживается)
+        
+        Задержка не превышает limit: в /ask нет model_deadline, и без
+        ограничения "Retry-After: 3600" задержал бы ответ на час.
+        """
+        if not value:
+            return None
+        try:
+            return min(max(float(value), 0.0), limit)
+        except ValueError:
+            return None
+    
     async def get_response(
         self,
         model_key: str,
         messages: List[Dict[str, str]],
         temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        provider: Optional[Dict[str, Any]] = None
     ) -> Optional[AIResponse]:
         """
         Получить ответ от конкретной модели
@@ -121,48 +287,180 @@ class OpenRouterClient:
             messages: Список сообщений
             temperature: Температура (если None, берется из конфигурации)
             max_tokens: Максимум токенов (если None, берется из конфигурации)
+            provider: Настройки маршрутизации OpenRouter (например, порядок провайдеров)
             
         Returns:
             AIResponse или None
         """
-        model_config = config.get_model_config(model_key)
-        if not model_config:
+        params = self.get_model_params(model_key)
+        if not params:
             log.error(f"Модель {model_key} не найдена в конфигурации")
             return None
         
-        temp = temperature if temperature is not None else model_config.get('temperature', 0.2)
-        tokens = max_tokens if max_tokens is not None else model_config.get('max_tokens', 8192)
-        reasoning = model_config.get('reasoning', 'high')
-        verbosity = model_config.get('verbosity', 'high')
+        temp = temperature if temperature is not None else params['temperature']
+        tokens = max_tokens if max_tokens is not None else params['max_tokens']
         
-        log.info(f"Запрос к модели {model_config['name']} ({model_config['id']}) с reasoning={reasoning}")
+        log.info(f"Запрос к модели {params['name']} ({params['id']}) с reasoning={params['reasoning']}")
         
         response = await self._make_request(
-            model_id=model_config['id'],
+            model_id=params['id'],
             messages=messages,
             temperature=temp,
             max_tokens=tokens,
-            reasoning=reasoning,
-            verbosity=verbosity
+            reasoning=params['reasoning'],
+            verbosity=params['verbosity'],
+            provider=provider
         )
         
         if response:
-            content = response.get_content()
-            tokens_used = response.get_tokens_used()
-            
-            # Попытка извлечь уверенность из ответа
-            confidence = self._extract_confidence(content)
-            
-            return AIResponse(
-                model_key=model_key,
-                model_name=model_config['name'],
-                content=content,
-                confidence=confidence,
-                tokens_used=tokens_used
-            )
+            return self.make_response(model_key, response.get_content(), response.get_tokens_used())
         
         return None
     
+    def make_response(
+        self,
+        model_key: str,
+        content: str,
+        tokens_used: Optional[int] = None
+    ) -> AIResponse:
+        """
+        Собрать AIResponse из текста ответа модели
+        
+        Уверенность извлекается из текста ответа.
+        """
+        params = self.get_model_params(model_key) or {}
+        return AIResponse(
+            model_key=model_key,
+            model_name=params.get('name', model_key),
+            content=content,
+            confidence=self._extract_confidence(content),
+            tokens_used=tokens_used
+        )
+    
+    async def stream_response(
+        self,
+        model_key: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        usage: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Получать ответ модели по частям по мере генерации (SSE)
+        
+        Потоковый запрос не повторяется при ошибке: часть текста
+        уже могла быть отдана потребителю. Ошибка API, таймаут или обрыв
+        соединения до [DONE] поднимают StreamInterruptedError, чтобы
+        неполный текст не был принят за готовый ответ.
+        
+        Слот семафора занят на все время потока, включая паузы, пока
+        потребитель обрабатывает очередной фрагмент. Потребитель не должен
+        надолго задерживать итерацию: stream_answer правит сообщение в
+        Telegram не чаще PROGRESS_EDIT_INTERVAL.
+        
+        Args:
+            model_key: Ключ модели из конфигурации
+            messages: Список сообщений
+            temperature: Температура (если None, берется из конфигурации)
+            max_tokens: Максимум токенов (если None, берется из конфигурации)
+            usage: Словарь, в который записывается статистика токенов
+                из последнего события потока
+            
+        Yields:
+            Очередные фрагменты текста ответа
+        """
+        params = self.get_model_params(model_key)
+        if not params:
+            log.error(f"Модель {model_key} не найдена в конфигурации")
+            return
+        
+        request_dict = self._build_request(
+            params['id'],
+            messages,
+            temperature if temperature is not None else params['temperature'],
+            max_tokens if max_tokens is not None else params['max_tokens'],
+            params['reasoning'],
+            params['verbosity']
+        )
+        request_dict["stream"] = True
+        
+        log.info(f"Потоковый запрос к модели {params['name']} ({params['id']})")
+        
+        finished = False
+        try:
+            # Порядок как в _make_request: сначала слот, затем токен частоты
+            async with self._sem:
+                await self._rate_limiter.acquire()
+                session = await self._get_session()
+                async with session.post(
+                    f"{self.base_url}/chat/completions",
+                    json=request_dict,
+                    headers={'Accept': 'text/event-stream'}
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        log.error(f"Ошибка API: статус {response.status}, текст: {error_text}")
+                        raise StreamInterruptedError(f"статус {response.status}")
+                    
+                    async for line in response.content:
+                        line = line.strip()
+                        # Пустые строки разделяют события, строки с ":" - комментарии
+                        if not line.startswith(b'data:'):
+                            continue
+                        payload = line[5:].strip()
+                        if payload == b'[DONE]':
+                            finished = True
+                            break
+                        
+                        event = _sse_decoder.decode(payload)
+                        if usage is not None and event.get('usage'):
+                            usage.update(event['usage'])
+                        for choice in event.get('choices') or ():
+                            delta = (choice.get('delta') or {}).get('content')
+                            if delta:
+                                yield delta
+        except StreamInterruptedError:
+            raise
+        except asyncio.TimeoutError as e:
+            log.error(f"Таймаут потокового запроса к {params['id']}")
+            raise StreamInterruptedError("таймаут") from e
+        except Exception as e:
+            log.error(f"Ошибка при потоковом запросе к {params['id']}: {str(e)}")
+            raise StreamInterruptedError(str(e)) from e
+        
+        if not finished:
+            log.error(f"Поток ответа {params['id']} оборвался до [DONE]")
+            raise StreamInterruptedError("поток оборвался до завершения")
+    
+    async def get_embedding(self, text: str, model: str) -> Optional[List[float]]:
+        """
+        Получить эмбеддинг текста (эндпоинт /embeddings)
+        
+        Args:
+            text: Текст для эмбеддинга
+            model: ID модели эмбеддингов в OpenRouter
+            
+        Returns:
+            Вектор эмбеддинга или None в случае ошибки
+        """
+        try:
+            async with self._sem:
+                await self._rate_limiter.acquire()
+                session = await self._get_session()
+                async with session.post(
+                    f"{self.base_url}/embeddings",
+                    json={"model": model, "input": text}
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        log.warning(f"Ошибка эмбеддинга: статус {response.status}, текст: {error_text}")
+                        return None
+                    data = msgspec.json.decode(await response.read())
+                    return data['data'][0]['embedding']
+        except Exception as e:
+            log.warning(f"Ошибка при запросе эмбеддинга: {str(e)}")
+            return None
+    
     async def get_multiple_responses(
         self,
         model_keys: List[str],
@@ -192,29 +490,57 @@ class OpenRouterClient:
         # Фильтруем None значения
         return [r for r in responses if r is not None]
     
+    def _with_prompt_cache(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Пометить системные сообщения для кэширования префикса у провайдера
+        
+        Системный промпт одинаков во всех запросах дебатов, поэтому после первого
+        запроса провайдер (Anthropic, Gemini) берет его из кэша. OpenAI кэширует
+        префикс автоматически, лишние поля им игнорируются.
+        
+        Провайдеры не кэшируют префикс короче ~1024 токенов, поэтому сообщения
+        короче prompt_cache_min_chars остаются как есть.
+        
+        Размеченное сообщение строится один раз на текст промпта и дальше
+        переиспользуется, так что префикс запроса сериализуется байт в байт
+        одинаково.
+        """
+        return [
+            self._cached_system_message(message["content"])
+            if (
+                message["role"] == "system"
+                and isinstance(message["content"], str)
+                and len(message["content"]) >= self.prompt_cache_min_chars
+            )
+            else message
+            for message in messages
+        ]
+    
+    def _cached_system_message(self, text: str) -> Dict[str, Any]:
+        """Системное сообщение с пометкой cache_control (мемоизировано по тексту)"""
+        message = self._system_messages.get(text)
+        if message is None:
+            message = {
+                "role": "system",
+                "content": [{
+                    "type": "text",
+                    "text": text,
+                    "cache_control": {"type": "ephemeral"}
+                }]
+            }
+            self._system_messages[text] = message
+        return message
+    
     def _extract_confidence(self, content: str) -> Optional[float]:
         """
         Попытка извлечь уверенность из текста ответа
         
         Ищет паттерны типа "Уверенность: 85%" или "Confidence: 85%"
         """
-        import re
-        
-        patterns = [
-            r'[Уу]веренность[:\s]+(\d+)%',
-            r'[Cc]onfidence[:\s]+(\d+)%',
-            r'(\d+)%\s+[уУ]веренност',
-            r'(\d+)%\s+[cC]onfiden'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, content)
+        for pattern in _CONF_PATTERNS:
+            match = pattern.search(content)
             if match:
-                try:
-                    return float(match.group(1))
-                except ValueError:
-                    continue
-        
+                return float(match.group(1))
         return None
 
 
@@ -0,0 +1,44 @@
+"""
+Ограничение частоты запросов к AI провайдеру
+"""
+import time
+import asyncio
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов по алгоритму token bucket
+    
+    Допускает всплеск до requests_per_minute запросов, после чего
+    пропускает запросы с равномерной скоростью requests_per_minute / 60 в секунду.
+    """
+    
+    def __init__(self, requests_per_minute: Optional[float]):
+        self.enabled = bool(requests_per_minute)
+        self.capacity = float(requests_per_minute or 0)
+        self.rate = self.capacity / 60.0
+        
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Дождаться разрешения на один запрос"""
+        if not self.enabled:
+            return
+        
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self._tokens) / self.rate)
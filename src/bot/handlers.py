@@ -1,12 +1,17 @@
 """
 Обработчики команд и сообщений Telegram бота
 """
+import time
+import asyncio
+from typing import List, Optional, Sequence
+
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
 
-from utils import log, config
-from ai import debate_manager, openrouter_client
+from utils import log, config, semantic_cache
+from ai import debate_manager, openrouter_client, cached_client, AIResponse, StreamInterruptedError
 from bot.keyboards import (
     get_main_menu_keyboard,
     get_debate_mode_keyboard,
@@ -17,13 +22,26 @@ from bot.keyboards import (
 # Состояния для ConversationHandler
 WAITING_QUESTION, WAITING_DEBATE_QUESTION, WAITING_MODEL_CHOICE = range(3)
 
+# Минимальный интервал между правками сообщения о ходе дебатов (секунд)
+PROGRESS_EDIT_INTERVAL = 1.0
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start"""
-    user = update.effective_user
-    
-    welcome_text = f"""
-👋 Привет, {user.first_name}!
+# Максимальная длина части длинного ответа (лимит Telegram - 4096 символов)
+MESSAGE_LIMIT = 4000
+
+# Ответ на новый вопрос, пока предыдущий еще обрабатывается
+BUSY_TEXT = "⏳ Уже обрабатываю ваш предыдущий вопрос, дождитесь ответа"
+
+# Системный промпт режима одной модели. Один и тот же объект во всех запросах,
+# чтобы префикс совпадал и провайдер мог взять его из кэша промптов
+SYSTEM_PROMPT = (
+    "Ты полезный AI ассистент. Отвечай точно, обоснованно "
+    "и указывай степень уверенности в процентах."
+)
+SYSTEM_PROMPT_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Приветствие: между частями подставляется только имя пользователя
+WELCOME_HEAD = "\n👋 Привет, "
+WELCOME_TAIL = """!
 
 Я **AI Debate Bot** - бот, который использует несколько мощнейших AI моделей для поиска наиболее точных ответов на ваши вопросы.
 
@@ -48,19 +66,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /history - История запросов
 /help - Справка
 """
-    
-    await update.message.reply_text(
-        welcome_text,
-        reply_markup=get_main_menu_keyboard(),
-        parse_mode=ParseMode.MARKDOWN
-    )
-    
-    log.info(f"Пользователь {user.id} ({user.username}) запустил бота")
 
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /help"""
-    help_text = """
+HELP_TEXT = """
 📖 **Справка по использованию AI Debate Bot**
 
 **Основные команды:**
@@ -98,8 +105,26 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Возникли вопросы? Напишите разработчику: @your_username
 """
+
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /start"""
+    user = update.effective_user
+    
+    welcome_text = WELCOME_HEAD + user.first_name + WELCOME_TAIL
     
-    await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
+    await update.message.reply_text(
+        welcome_text,
+        reply_markup=get_main_menu_keyboard(),
+        parse_mode=ParseMode.MARKDOWN
+    )
+    
+    log.info(f"Пользователь {user.id} ({user.username}) запустил бота")
+
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /help"""
+    await update.message.reply_text(HELP_TEXT, parse_mode=ParseMode.MARKDOWN)
 
 
 async def ask_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -145,6 +170,9 @@ async def process_single_question(update: Update, context: ContextTypes.DEFAULT_
     
     model_config = config.get_model_config(model_key)
     
+    if not await begin_inflight(update, context):
+        return ConversationHandler.END
+    
     # Отправляем сообщение о начале обработки
     processing_msg = await update.message.reply_text(
         f"⏳ Отправляю вопрос модели {model_config.color} **{model_config.name}**...",
@@ -152,16 +180,22 @@ async def process_single_question(update: Update, context: ContextTypes.DEFAULT_
     )
     
     try:
-        # Получаем ответ от модели
-        messages = [
-            {"role": "system", "content": "Ты полезный AI ассистент. Отвечай точно, обоснованно и указывай степень уверенности в процентах."},
-            {"role": "user", "content": question}
-        ]
+        # Похожий вопрос этой же модели мог уже задавать этот же пользователь
+        namespace = f"ask:{update.effective_user.id}:{model_key}"
+        embedding = await question_embedding(question)
+        response = semantic_cache.lookup(namespace, embedding)
         
-        response = await openrouter_client.get_response(
-            model_key=model_key,
-            messages=messages
-        )
+        if response is None:
+            # Получаем ответ от модели
+            messages = [SYSTEM_PROMPT_MSG, {"role": "user", "content": question}]
+            
+            # Текст ответа показывается по мере генерации. Точные повторы
+            # вопроса отдаются из кэша ответов, только если
+            # llm_cache.max_temperature не ниже температуры модели
+            header = f"{model_config.color} {model_config.name}\n\n"
+            response = await stream_answer(processing_msg, header, model_key, messages)
+            if response:
+                semantic_cache.add(namespace, embedding, response)
         
         if response:
             # Форматируем ответ
@@ -186,6 +220,8 @@ async def process_single_question(update: Update, context: ContextTypes.DEFAULT_
     except Exception as e:
         await processing_msg.edit_text(f"❌ Произошла ошибка: {str(e)}")
         log.error(f"Ошибка при обработке вопроса: {e}")
+    finally:
+        end_inflight(update, context)
     
     return ConversationHandler.END
 
@@ -230,6 +266,9 @@ async def process_debate_question(update: Update, context: ContextTypes.DEFAULT_
     
     mode_config = config.get_debate_mode(mode)
     
+    if not await begin_inflight(update, context):
+        return ConversationHandler.END
+    
     # Отправляем сообщение о начале дебатов
     processing_msg = await update.message.reply_text(
         f"🎯 Запускаю дебаты в режиме **{mode_config.name}** ({mode_config.rounds} раундов)...\n\n"
@@ -238,25 +277,51 @@ async def process_debate_question(update: Update, context: ContextTypes.DEFAULT_
     )
     
     try:
-        # Запускаем дебаты
-        session = await debate_manager.start_debate(
-            user_id=user_id,
-            question=question,
-            mode=mode
-        )
+        # Дебаты по похожему вопросу этого пользователя в этом режиме могли уже проводиться
+        namespace = f"debate:{user_id}:{mode}"
+        embedding = await question_embedding(question)
+        session = semantic_cache.lookup(namespace, embedding)
+        
+        if session is not None:
+            # Показываем вопрос в текущей формулировке, а не в сохраненной
+            session = session.reuse_for(user_id, question)
+        else:
+            # Запускаем дебаты, показывая ход после каждого раунда
+            last_edit = 0.0
+            async for session in debate_manager.stream_debate(
+                user_id=user_id,
+                question=question,
+                mode=mode
+            ):
+                if session.completed_at is not None:
+                    continue
+                
+                now = time.monotonic()
+                if now - last_edit < PROGRESS_EDIT_INTERVAL:
+                    continue
+                last_edit = now
+                
+                try:
+                    await processing_msg.edit_text(
+                        render_progress(session, mode_config.rounds),
+                        parse_mode=ParseMode.MARKDOWN
+                    )
+                except TelegramError as e:
+                    log.warning(f"Не удалось обновить ход дебатов: {e}")
+            
+            semantic_cache.add(namespace, embedding, session)
         
         # Форматируем результаты
         result_text = debate_manager.format_debate_for_user(session)
         
         # Отправляем результат (разбиваем на части, если слишком длинный)
-        max_length = 4000
-        if len(result_text) <= max_length:
+        parts = pack_markdown(result_text)
+        if len(parts) == 1:
             await processing_msg.edit_text(result_text, parse_mode=ParseMode.MARKDOWN)
         else:
-            # Отправляем по частям
+            # Отправляем по частям, последовательно - чтобы сохранить порядок
             await processing_msg.delete()
             
-            parts = [result_text[i:i+max_length] for i in range(0, len(result_text), max_length)]
             for i, part in enumerate(parts):
                 if i == 0:
                     await update.message.reply_text(part, parse_mode=ParseMode.MARKDOWN)
@@ -268,10 +333,149 @@ async def process_debate_question(update: Update, context: ContextTypes.DEFAULT_
     except Exception as e:
         await processing_msg.edit_text(f"❌ Произошла ошибка при проведении дебатов: {str(e)}")
         log.error(f"Ошибка при проведении дебатов: {e}", exc_info=True)
+    finally:
+        end_inflight(update, context)
     
     return ConversationHandler.END
 
 
+async def begin_inflight(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """
+    Отметить, что вопрос пользователя обрабатывается
+    
+    Если предыдущий вопрос этого пользователя еще в работе (повторное нажатие,
+    дубль сообщения), отвечает об этом и возвращает False - новый запрос к
+    моделям не запускается.
+    """
+    inflight = context.application.bot_data.setdefault('inflight', {})
+    user_id = update.effective_user.id
+    
+    task = inflight.get(user_id)
+    if task is not None and not task.done():
+        await update.message.reply_text(BUSY_TEXT)
+        log.info(f"Повторный вопрос от пользователя {user_id} во время обработки пропущен")
+        return False
+    
+    inflight[user_id] = asyncio.current_task()
+    return True
+
+
+async def busy_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Ответ на сообщение, пришедшее во время обработки предыдущего вопроса
+    
+    Регистрируется в состоянии ConversationHandler.WAITING: пока обработчик
+    вопроса (block=False) не завершился, разговор находится в этом состоянии.
+    """
+    await update.message.reply_text(BUSY_TEXT)
+    log.info(f"Сообщение от пользователя {update.effective_user.id} во время обработки вопроса пропущено")
+
+
+def end_inflight(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Снять отметку об обработке вопроса пользователя"""
+    inflight = context.application.bot_data.get('inflight', {})
+    if inflight.get(update.effective_user.id) is asyncio.current_task():
+        del inflight[update.effective_user.id]
+
+
+def pack_markdown(
+    text: str,
+    limit: int = MESSAGE_LIMIT,
+    separators: Sequence[str] = ("\n\n", "\n")
+) -> List[str]:
+    """
+    Разбить текст на части не длиннее limit по границам абзацев
+    
+    Абзацы собираются в части жадно; абзац длиннее лимита делится по строкам,
+    а строка длиннее лимита - по символам. Так разметка Markdown не рвется
+    посреди абзаца, если этого можно избежать.
+    """
+    if len(text) <= limit:
+        return [text]
+    if not separators:
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+    
+    separator, finer = separators[0], separators[1:]
+    parts: List[str] = []
+    buf = ""
+    for piece in text.split(separator):
+        for chunk in pack_markdown(piece, limit, finer):
+            if buf and len(buf) + len(separator) + len(chunk) > limit:
+                parts.append(buf)
+                buf = chunk
+            else:
+                buf = buf + separator + chunk if buf else chunk
+    if buf:
+        parts.append(buf)
+    return parts
+
+
+async def stream_answer(
+    message,
+    header: str,
+    model_key: str,
+    messages: List[dict]
+) -> Optional[AIResponse]:
+    """
+    Получить ответ модели потоком, показывая накопленный текст в сообщении
+    
+    Сообщение правится не чаще PROGRESS_EDIT_INTERVAL, без разметки: в
+    незавершенном тексте Markdown может быть не закрыт. Итоговый ответ
+    форматирует вызывающий код.
+    
+    Если поток оборвался до первого фрагмента, ответ запрашивается обычным
+    запросом (с повторами при 429/5xx). Оборванный посреди ответа поток
+    считается ошибкой: неполный текст не выдается за ответ.
+    """
+    usage = {}
+    chunks: List[str] = []
+    last_edit = time.monotonic()
+    
+    try:
+        async for chunk in cached_client.stream_response(model_key, messages, usage=usage):
+            chunks.append(chunk)
+            now = time.monotonic()
+            if now - last_edit < PROGRESS_EDIT_INTERVAL:
+                continue
+            
+            last_edit = now
+            preview = ''.join(chunks)[-(MESSAGE_LIMIT - len(header) - 2):]
+            try:
+                await message.edit_text(f"{header}{preview} ▌")
+            except TelegramError as e:
+                log.debug(f"Не удалось обновить потоковый ответ: {e}")
+    except StreamInterruptedError as e:
+        if chunks:
+            log.error(f"Потоковый ответ {model_key} оборвался после {len(chunks)} фрагментов: {e}")
+            return None
+        log.warning(f"Потоковый запрос к {model_key} не удался ({e}), повторяю без потока")
+        return await cached_client.get_response(model_key=model_key, messages=messages)
+    
+    if not chunks:
+        return None
+    return cached_client.make_response(model_key, ''.join(chunks), usage.get('total_tokens'))
+
+
+async def question_embedding(question: str):
+    """Эмбеддинг вопроса для семантического кэша (None, если кэш выключен)"""
+    if not semantic_cache.enabled:
+        return None
+    return await openrouter_client.get_embedding(question, semantic_cache.model)
+
+
+def render_progress(session, rounds_total: int) -> str:
+    """Текст сообщения о ходе дебатов после очередного раунда"""
+    last_round = session.rounds[-1]
+    responded = ', '.join(response.model_name for response in last_round.responses)
+    
+    return (
+        f"🎯 Идут дебаты...\n\n"
+        f"✅ Раунд {last_round.round_number}/{rounds_total} завершен\n"
+        f"Ответили: {responded or '—'}\n\n"
+        f"Продолжаю ⏳"
+    )
+
+
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /settings"""
     await update.message.reply_text(
@@ -291,25 +495,26 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# Кнопки главного меню -> обработчики
+TEXT_ROUTES = {
+    '🤖 Задать вопрос одной модели': ask_command,
+    '🎯 Запустить дебаты': debate_command,
+    '⚙️ Настройки': settings_command,
+    '📊 История': history_command,
+    'ℹ️ Помощь': help_command
+}
+
+
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений (кнопки меню)"""
-    text = update.message.text
-    
-    if text == '🤖 Задать вопрос одной модели':
-        return await ask_command(update, context)
-    elif text == '🎯 Запустить дебаты':
-        return await debate_command(update, context)
-    elif text == '⚙️ Настройки':
-        return await settings_command(update, context)
-    elif text == '📊 История':
-        return await history_command(update, context)
-    elif text == 'ℹ️ Помощь':
-        return await help_command(update, context)
-    else:
-        await update.message.reply_text(
-            "Используйте кнопки меню или команды для работы с ботом.\n"
-            "Введите /help для справки."
-        )
+    handler = TEXT_ROUTES.get(update.message.text)
+    if handler is not None:
+        return await handler(update, context)
+    
+    await update.message.reply_text(
+        "Используйте кнопки меню или команды для работы с ботом.\n"
+        "Введите /help для справки."
+    )
 
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
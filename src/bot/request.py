@@ -0,0 +1,21 @@
+"""
+HTTP-запросы к Telegram Bot API с разбором JSON через orjson
+"""
+import orjson
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+
+from utils import log
+
+
+class OrjsonHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, разбирающий ответы Telegram через orjson"""
+    
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        """Разобрать тело ответа Telegram (orjson читает bytes напрямую)"""
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            log.error(f"Некорректный JSON от Telegram: {payload[:200]!r}")
+            raise TelegramError("Invalid server response") from exc
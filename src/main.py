@@ -20,7 +20,9 @@ from telegram.ext import (
     filters
 )
 
-from utils import config, log
+from utils import config, log, semantic_cache
+from ai import openrouter_client, debate_manager
+from bot.request import OrjsonHTTPXRequest
 from bot.handlers import (
     start_command,
     help_command,
@@ -35,22 +37,46 @@ from bot.handlers import (
     process_single_question,
     debate_mode_selected,
     process_debate_question,
+    busy_reply,
     WAITING_QUESTION,
     WAITING_DEBATE_QUESTION,
     WAITING_MODEL_CHOICE
 )
 
 
-def main():
-    """Главная функция запуска бота"""
-    
-    # Настройка логирования
-    log.info("=" * 50)
-    log.info("Запуск Telegram AI Debate Bot")
-    log.info("=" * 50)
-    
-    # Создание приложения
-    app = Application.builder().token(config.settings.telegram_bot_token).build()
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов при остановке бота"""
+    await debate_manager.wait_saved()
+    await openrouter_client.close()
+    semantic_cache.save()
+    # Дожидаемся записи логов, оставшихся в очереди
+    await log.complete()
+
+
+def install_uvloop():
+    """Использовать uvloop как event loop, если он доступен (не на Windows)"""
+    if sys.platform == 'win32':
+        return
+    try:
+        import uvloop
+    except ImportError:
+        log.warning("uvloop не установлен, используется стандартный event loop")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    log.info("⚡ Event loop: uvloop")
+
+
+def build_application() -> Application:
+    """Создать приложение и зарегистрировать обработчики"""
+    app = (
+        Application.builder()
+        .token(config.settings.telegram_bot_token)
+        .request(OrjsonHTTPXRequest(connection_pool_size=256))
+        .get_updates_request(OrjsonHTTPXRequest())
+        .concurrent_updates(True)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # ConversationHandler для режима одной модели
     ask_conversation = ConversationHandler(
@@ -63,7 +89,12 @@ def main():
                 CallbackQueryHandler(model_selected, pattern='^model_')
             ],
             WAITING_QUESTION: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, process_single_question)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, process_single_question, block=False)
+            ],
+            # Пока вопрос обрабатывается (block=False), новые сообщения
+            # получают ответ "уже обрабатываю" и не уходят в меню
+            ConversationHandler.WAITING: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, busy_reply)
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel_command)]
@@ -78,7 +109,10 @@ def main():
         states={
             WAITING_DEBATE_QUESTION: [
                 CallbackQueryHandler(debate_mode_selected, pattern='^debate_mode_'),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, process_debate_question)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, process_debate_question, block=False)
+            ],
+            ConversationHandler.WAITING: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, busy_reply)
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel_command)]
@@ -100,6 +134,19 @@ def main():
     # Обработчик ошибок
     app.add_error_handler(error_handler)
     
+    return app
+
+
+def main():
+    """Главная функция запуска бота"""
+    
+    # Настройка логирования
+    log.info("=" * 50)
+    log.info("Запуск Telegram AI Debate Bot")
+    log.info("=" * 50)
+    
+    app = build_application()
+    
     # Запуск бота
     log.info("Бот запущен и готов к работе!")
     log.info(f"Режимы дебатов: {', '.join(config.debate_modes.keys())}")
@@ -109,6 +156,7 @@ def main():
     log.info("🧪 MIT Multi-Agent Debate фреймворк включен")
     
     # Polling
+    install_uvloop()
     app.run_polling(allowed_updates=['message', 'callback_query'])
 
 
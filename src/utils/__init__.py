@@ -1,5 +1,6 @@
 """Утилиты для Telegram AI Debate Bot"""
 from .config import config, ConfigV2, Settings
 from .logger import log, setup_logger
+from .semcache import semantic_cache, SemanticCache
 
-__all__ = ['config', 'ConfigV2', 'Settings', 'log', 'setup_logger']
+__all__ = ['config', 'ConfigV2', 'Settings', 'log', 'setup_logger', 'semantic_cache', 'SemanticCache']
@@ -4,7 +4,8 @@
 import os
 import yaml
 from pathlib import Path
-from typing import Dict, Any, List
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 
@@ -35,26 +36,37 @@ class ConfigV2:
     
     def _load_yaml_config(self):
         """Загрузка конфигурации из YAML файла"""
-        with open(self.config_path, 'r', encoding='utf-8') as f:
-            config_data = yaml.safe_load(f)
+        config_data = self._read_config_data()
         
         # Сохраняем все данные как есть
-        self.models = config_data['models']
-        self.debate_modes = config_data['debate_modes']
+        # Модели и режимы - пространства имен: доступ как model_config.name
+        self.models = {k: SimpleNamespace(**v) for k, v in config_data['models'].items()}
+        self.debate_modes = {k: SimpleNamespace(**v) for k, v in config_data['debate_modes'].items()}
         self.prompts = config_data['prompts']
         self.openrouter = config_data['openrouter']
+        self.llm_cache = config_data.get('llm_cache', {})
+        self.debate_cache = config_data.get('debate_cache', {})
+        self.consensus = config_data.get('consensus', {})
+        self.hedging = config_data.get('hedging', {})
+        self.semantic_cache = config_data.get('semantic_cache', {})
         self.logging = config_data.get('logging', {})
         self.paths = config_data.get('paths', {})
     
-    def get_model_config(self, model_key: str) -> Dict[str, Any]:
+    def _read_config_data(self) -> Dict[str, Any]:
+        """Прочитать YAML (C-реализация загрузчика, если PyYAML собран с libyaml)"""
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        with open(self.config_path, 'r', encoding='utf-8') as f:
+            return yaml.load(f, Loader=loader)
+    
+    def get_model_config(self, model_key: str) -> Optional[SimpleNamespace]:
         """Получить конфигурацию модели по ключу"""
         return self.models.get(model_key)
     
-    def get_all_models(self) -> Dict[str, Dict[str, Any]]:
+    def get_all_models(self) -> Dict[str, SimpleNamespace]:
         """Получить все модели"""
         return self.models
     
-    def get_debate_mode(self, mode: str) -> Dict[str, Any]:
+    def get_debate_mode(self, mode: str) -> SimpleNamespace:
         """Получить конфигурацию режима дебатов"""
         return self.debate_modes.get(mode, self.debate_modes['standard'])
     
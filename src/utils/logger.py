@@ -28,12 +28,16 @@ def setup_logger(log_level: str = "INFO"):
         "<level>{message}</level>"
     )
     
+    # Все синки пишут через очередь (enqueue=True): запись на диск, ротация
+    # и сжатие выполняются в фоновом потоке и не блокируют event loop
+    
     # Консольный вывод
     logger.add(
         sys.stdout,
         format=log_format,
         level=log_level,
-        colorize=True
+        colorize=True,
+        enqueue=True
     )
     
     # Файл с общими логами
@@ -43,7 +47,10 @@ def setup_logger(log_level: str = "INFO"):
         level=log_level,
         rotation="10 MB",
         retention="7 days",
-        compression="zip"
+        compression="zip",
+        enqueue=True,
+        backtrace=False,
+        diagnose=False
     )
     
     # Файл только с ошибками
@@ -53,7 +60,10 @@ def setup_logger(log_level: str = "INFO"):
         level="ERROR",
         rotation="10 MB",
         retention="30 days",
-        compression="zip"
+        compression="zip",
+        enqueue=True,
+        backtrace=False,
+        diagnose=False
     )
     
     return logger
@@ -0,0 +1,147 @@
+"""
+Семантический кэш ответов: поиск ранее заданного вопроса по смыслу
+"""
+import pickle
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .config import config
+from .logger import log
+
+
+class SemanticCache:
+    """
+    Кэш результатов по эмбеддингам вопросов
+    
+    Записи разделены по пространствам имен пользователя и режима или модели
+    ("debate:{user_id}:{mode}", "ask:{user_id}:{model_key}"): ответ одного
+    пользователя не отдается другому, а ответ одной модели не подставляется
+    вместо другой.
+    Поиск - косинусное сходство с нормированными векторами через numpy.
+    Общее число записей ограничено max_total_entries: сверх него удаляются
+    пространства имен, в которые дольше всего ничего не добавлялось.
+    """
+    
+    def __init__(
+        self,
+        enabled: bool = True,
+        model: str = "openai/text-embedding-3-small",
+        threshold: float = 0.93,
+        max_entries: int = 500,
+        max_total_entries: int = 5000,
+        persist_path: Optional[Path] = None
+    ):
+        self.enabled = enabled
+        self.model = model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_total_entries = max_total_entries
+        self.persist_path = persist_path
+        
+        # namespace -> матрица нормированных эмбеддингов (n, dim) и значения;
+        # порядок ключей - от давно не пополнявшихся пространств имен к свежим
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._values: Dict[str, List[Any]] = {}
+        
+        if self.enabled and self.persist_path:
+            self.load()
+    
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        """Привести эмбеддинг к единичной длине"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def lookup(self, namespace: str, embedding: Optional[Sequence[float]]) -> Optional[Any]:
+        """
+        Найти значение для ближайшего по смыслу вопроса
+        
+        Args:
+            namespace: Пространство имен записей
+            embedding: Эмбеддинг вопроса (None - кэш не используется)
+        
+        Returns:
+            Сохраненное значение или None, если сходство ниже порога
+        """
+        if not self.enabled or embedding is None:
+            return None
+        
+        vectors = self._vectors.get(namespace)
+        if vectors is None or vectors.shape[1] != len(embedding):
+            # Пусто или записи сделаны другой моделью эмбеддингов
+            return None
+        
+        scores = vectors @ self._normalize(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        
+        log.info(f"Семантический кэш ({namespace}): сходство {scores[best]:.3f}")
+        return self._values[namespace][best]
+    
+    def add(self, namespace: str, embedding: Optional[Sequence[float]], value: Any):
+        """Добавить запись, вытесняя самые старые сверх max_entries"""
+        if not self.enabled or embedding is None:
+            return
+        
+        vector = self._normalize(embedding)[np.newaxis, :]
+        # Пространство имен переносится в конец порядка вытеснения
+        vectors = self._vectors.pop(namespace, None)
+        values = self._values.pop(namespace, None)
+        if vectors is None or vectors.shape[1] != vector.shape[1]:
+            # Новое пространство имен или сменилась модель эмбеддингов
+            self._vectors[namespace] = vector
+            self._values[namespace] = [value]
+        else:
+            self._vectors[namespace] = np.vstack([vectors, vector])[-self.max_entries:]
+            self._values[namespace] = (values + [value])[-self.max_entries:]
+        
+        self._evict()
+    
+    def _evict(self):
+        """Удалить давно не пополнявшиеся пространства имен сверх max_total_entries"""
+        total = sum(len(values) for values in self._values.values())
+        while total > self.max_total_entries and len(self._values) > 1:
+            oldest = next(iter(self._values))
+            total -= len(self._values.pop(oldest))
+            del self._vectors[oldest]
+    
+    def load(self):
+        """Загрузить кэш с диска"""
+        try:
+            with open(self.persist_path, 'rb') as f:
+                self._vectors, self._values = pickle.load(f)
+            self._evict()
+            log.info(f"Семантический кэш загружен: {sum(len(v) for v in self._values.values())} записей")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning(f"Ошибка чтения семантического кэша {self.persist_path}: {e}")
+    
+    def save(self):
+        """Сохранить кэш на диск (вызывается при остановке бота)"""
+        if not self.enabled or not self.persist_path:
+            return
+        
+        try:
+            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.persist_path, 'wb') as f:
+                pickle.dump((self._vectors, self._values), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            log.warning(f"Ошибка записи семантического кэша {self.persist_path}: {e}")
+
+
+_semcache_config = config.semantic_cache
+
+# Глобальный экземпляр кэша
+semantic_cache = SemanticCache(
+    enabled=_semcache_config.get('enabled', False),
+    model=_semcache_config.get('model', "openai/text-embedding-3-small"),
+    threshold=_semcache_config.get('threshold', 0.93),
+    max_entries=_semcache_config.get('max_entries', 500),
+    max_total_entries=_semcache_config.get('max_total_entries', 5000),
+    persist_path=config.base_dir / "data" / "semantic_cache.pkl" if _semcache_config.get('persist') else None
+)
@@ -0,0 +1,13 @@
+"""
+Общие настройки тестов: путь к src и обязательные переменные окружения
+"""
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'test-token')
+os.environ.setdefault('OPENROUTER_API_KEY', 'test-key')
+
+src_dir = Path(__file__).parent.parent / 'src'
+if str(src_dir) not in sys.path:
+    sys.path.insert(0, str(src_dir))
@@ -0,0 +1,84 @@
+"""
+Тесты кэша ответов моделей (клиент OpenRouter подменен)
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from ai import cache
+from ai.cache import CachedClient
+from ai.models import AIResponse
+
+MESSAGES = [{"role": "user", "content": "Сколько будет 2+2?"}]
+
+
+class FakeClient:
+    """Клиент, считающий запросы; температура моделей задается в конструкторе"""
+    
+    def __init__(self, temperature: float = 0.0):
+        self.temperature = temperature
+        self.calls = 0
+    
+    def get_model_params(self, model_key):
+        return {'temperature': self.temperature}
+    
+    async def get_response(self, model_key, messages, temperature=None, max_tokens=None, provider=None):
+        self.calls += 1
+        return AIResponse(model_key=model_key, model_name=model_key, content=f'answer {self.calls}')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Подменяемое время для проверки TTL"""
+    now = [1000.0]
+    monkeypatch.setattr(cache, 'time', SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.mark.asyncio
+async def test_repeat_request_is_served_from_cache(clock):
+    client = FakeClient()
+    cached = CachedClient(client, ttl=60)
+    
+    first = await cached.get_response('claude', MESSAGES)
+    second = await cached.get_response('claude', MESSAGES)
+    
+    assert client.calls == 1
+    assert second.content == first.content
+    assert cached.stats == {'hits': 1, 'misses': 1}
+
+
+@pytest.mark.asyncio
+async def test_different_model_is_a_miss(clock):
+    client = FakeClient()
+    cached = CachedClient(client, ttl=60)
+    
+    await cached.get_response('claude', MESSAGES)
+    await cached.get_response('gemini', MESSAGES)
+    
+    assert client.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_entry_expires_after_ttl(clock):
+    client = FakeClient()
+    cached = CachedClient(client, ttl=60)
+    
+    await cached.get_response('claude', MESSAGES)
+    clock[0] += 61
+    response = await cached.get_response('claude', MESSAGES)
+    
+    assert client.calls == 2
+    assert response.content == 'answer 2'
+
+
+@pytest.mark.asyncio
+async def test_sampled_requests_bypass_cache(clock):
+    client = FakeClient(temperature=0.2)
+    cached = CachedClient(client, ttl=60, max_temperature=0.0)
+    
+    await cached.get_response('claude', MESSAGES)
+    await cached.get_response('claude', MESSAGES)
+    
+    assert client.calls == 2
+    assert cached.stats == {'hits': 0, 'misses': 0}
@@ -0,0 +1,84 @@
+"""
+Тесты маршрутизации сообщений в ConversationHandler во время обработки вопроса
+
+Разговор проходит через публичные check_update/handle_update; обработчики
+входа и вопроса подменены, чтобы не обращаться к Telegram и моделям.
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import CallbackContext, ConversationHandler
+
+from bot.handlers import busy_reply, WAITING_DEBATE_QUESTION, WAITING_QUESTION
+from main import build_application
+
+
+def text_update(text: str, update_id: int) -> Update:
+    user = User(id=1, first_name='Test', is_bot=False)
+    chat = Chat(id=1, type=Chat.PRIVATE)
+    message = Message(message_id=update_id, date=datetime.now(), chat=chat, from_user=user, text=text)
+    return Update(update_id=update_id, message=message)
+
+
+async def send(app, conversation: ConversationHandler, text: str, update_id: int) -> bool:
+    """Передать сообщение разговору; False - разговор его не принял"""
+    update = text_update(text, update_id)
+    check_result = conversation.check_update(update)
+    if check_result is None:
+        return False
+    context = CallbackContext.from_update(update, app)
+    await conversation.handle_update(update, app, check_result, context)
+    return True
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('entry_text, question_state', [
+    ('🤖 Задать вопрос одной модели', WAITING_QUESTION),
+    ('🎯 Запустить дебаты', WAITING_DEBATE_QUESTION),
+])
+async def test_message_during_processing_gets_busy_reply(entry_text, question_state):
+    app = build_application()
+    conversation = next(
+        h for h in app.handlers[0]
+        if isinstance(h, ConversationHandler) and question_state in h.states
+    )
+    
+    async def enter(update, context):
+        return question_state
+    
+    release = asyncio.Event()
+    
+    async def answer_question(update, context):
+        await release.wait()
+        return ConversationHandler.END
+    
+    busy_updates = []
+    
+    async def record_busy(update, context):
+        busy_updates.append(update.update_id)
+    
+    for handler in conversation.entry_points:
+        handler.callback = enter
+    for handler in conversation.states[question_state]:
+        if not handler.block:
+            handler.callback = answer_question
+    busy_handler, = conversation.states[ConversationHandler.WAITING]
+    assert busy_handler.callback is busy_reply
+    busy_handler.callback = record_busy
+    
+    assert await send(app, conversation, entry_text, 1)
+    assert await send(app, conversation, 'Первый вопрос', 2)
+    
+    # Пока вопрос обрабатывается, новое сообщение получает ответ "уже обрабатываю"
+    assert await send(app, conversation, 'Повторный вопрос', 3)
+    assert busy_updates == [3]
+    
+    # После ответа разговор завершен: текст больше не принимается
+    release.set()
+    await asyncio.sleep(0.05)
+    assert not await send(app, conversation, 'Еще вопрос', 4)
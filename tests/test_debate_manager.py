@@ -0,0 +1,136 @@
+"""
+Тесты менеджера дебатов (запросы к OpenRouter подменены)
+"""
+import pytest
+
+from ai import debate_manager
+from ai.models import AIResponse, OpenRouterResponse
+from ai.openrouter_client import OpenRouterClient
+from utils import config
+
+
+def make_response(model_id: str, content: str) -> OpenRouterResponse:
+    return OpenRouterResponse(
+        id='test',
+        model=model_id,
+        choices=[{'message': {'content': content}}],
+        usage={'total_tokens': 10}
+    )
+
+
+# Признаки промптов синтеза: раунд быстрого и глубокого режимов, стандартного
+# режима и запасной синтез
+SYNTHESIS_MARKERS = ('ДАННЫЕ ДЕБАТОВ', 'ДАННЫЕ ВСЕХ РАУНДОВ', 'Синтезируй финальный ответ')
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    """
+    Ответы моделей по типу запроса; по умолчанию все уверены на 95% - консенсус выполним
+    
+    Возвращает настройки подмены: converged=False - ответы моделей уверены
+    на 70% (консенсуса нет), fail_synthesis=True - синтез не отвечает.
+    В synthesis_requests считаются запросы синтеза.
+    """
+    settings = {'converged': True, 'fail_synthesis': False, 'synthesis_requests': 0}
+    
+    async def fake_make_request(self, model_id, messages, **kwargs):
+        prompt = messages[-1]['content']
+        confidence = 95
+        if any(marker in prompt for marker in SYNTHESIS_MARKERS):
+            settings['synthesis_requests'] += 1
+            if settings['fail_synthesis']:
+                return None
+            content = 'SYNTHESIS'
+        elif 'ВЗАИМНАЯ КРИТИКА' in prompt:
+            content = f'CRITIQUE by {model_id}'
+        else:
+            content = f'ANSWER by {model_id}'
+            if not settings['converged']:
+                confidence = 70
+        return make_response(model_id, f'{content}\nУверенность: {confidence}%')
+    
+    monkeypatch.setattr(OpenRouterClient, '_make_request', fake_make_request)
+    monkeypatch.setattr(debate_manager.debate_cache, 'enabled', False)
+    monkeypatch.setattr(debate_manager, '_save_debate', lambda session: None)
+    monkeypatch.setattr(debate_manager, '_hedging', {})
+    return settings
+
+
+@pytest.mark.asyncio
+async def test_quick_mode_uses_synthesis_from_last_round(fake_api):
+    fake_api['converged'] = False
+    
+    session = await debate_manager.start_debate(1, 'Сколько будет 2+2?', 'quick')
+    
+    assert session.final_answer.startswith('SYNTHESIS')
+    assert session.final_confidence == 95.0
+    assert not session.synthesis_skipped
+
+
+@pytest.mark.asyncio
+async def test_quick_mode_consensus_ignores_critiques(fake_api):
+    fake_api['fail_synthesis'] = True
+    
+    session = await debate_manager.start_debate(1, 'Сколько будет 3+3?', 'quick')
+    
+    # Консенсус ищется среди ответов раунда 1, а не среди критики
+    assert session.final_answer.startswith('ANSWER')
+    assert session.synthesis_skipped
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('mode', ['standard', 'deep'])
+async def test_converged_debate_makes_no_synthesis_request(fake_api, mode):
+    session = await debate_manager.start_debate(1, 'Сколько будет 4+4?', mode)
+    
+    assert fake_api['synthesis_requests'] == 0
+    assert session.final_answer.startswith('ANSWER')
+    assert session.synthesis_skipped
+
+
+def answers(*confidences):
+    return [
+        AIResponse(model_key=f'm{i}', model_name=f'M{i}', content=f'ANSWER {i}', confidence=confidence)
+        for i, confidence in enumerate(confidences)
+    ]
+
+
+@pytest.mark.parametrize('confidences, expected', [
+    ((90, 92, 88), ('ANSWER 1', 92)),  # все уверены, разброс 4
+    ((90, 95, 85), None),  # разброс больше max_gap
+    ((84, 86, 86), None),  # одна модель ниже min_confidence
+    ((90, None, 90), None),  # одна модель не указала уверенность
+    ((95,), None),  # одного ответа мало для консенсуса
+])
+def test_consensus_answer_thresholds(monkeypatch, confidences, expected):
+    monkeypatch.setattr(config, 'consensus', {'enabled': True, 'min_confidence': 85, 'max_gap': 5})
+    
+    assert debate_manager._consensus_answer(answers(*confidences)) == expected
+
+
+def test_consensus_answer_disabled(monkeypatch):
+    monkeypatch.setattr(config, 'consensus', {'enabled': False})
+    
+    assert debate_manager._consensus_answer(answers(95, 95)) is None
+
+
+def test_hedge_delay_uses_network_latencies(monkeypatch):
+    client = debate_manager.client
+    monkeypatch.setattr(client.client, '_latencies', {})
+    monkeypatch.setattr(debate_manager, '_hedging', {'enabled': True, 'initial_delay': 60, 'min_samples': 3})
+    
+    # Без альтернативных провайдеров запрос не дублируется
+    monkeypatch.setattr(debate_manager._m['claude'], 'hedge_providers', None, raising=False)
+    assert debate_manager._hedge_delay('claude') is None
+    
+    monkeypatch.setattr(debate_manager._m['claude'], 'hedge_providers', ['anthropic', 'amazon-bedrock'])
+    
+    # Пока замеров мало - начальная задержка
+    assert debate_manager._hedge_delay('claude') == 60
+    
+    model_id = client.get_model_params('claude')['id']
+    for elapsed in (1.0, 2.0, 3.0):
+        client.client._record_latency(model_id, elapsed)
+    
+    assert debate_manager._hedge_delay('claude') == 1.5 * 2.0
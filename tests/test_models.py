@@ -0,0 +1,49 @@
+"""
+Тесты моделей данных дебатов
+"""
+import pickle
+
+from ai.models import AIResponse, DebateRound, DebateSession
+
+
+def finished_session() -> DebateSession:
+    session = DebateSession(session_id='s1', user_id=1, question='Сколько будет 2+2?', mode='quick')
+    debate_round = DebateRound(
+        round_number=1,
+        responses=[AIResponse(model_key='claude', model_name='Claude', content='4', confidence=95.0, tokens_used=10)]
+    )
+    debate_round.formatted = '🟣 **Claude** (Analyst):\n4\nУверенность: 95.0%\n'
+    session.add_round(debate_round)
+    session.log_formatted_round(debate_round)
+    session.complete('4', 95.0)
+    return session
+
+
+def test_pickle_round_trip_drops_render_caches():
+    session = finished_session()
+    
+    restored = pickle.loads(pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL))
+    
+    assert restored.to_dict() == session.to_dict()
+    assert restored.rounds[0].formatted is None
+    assert restored.get_formatted_log() == ''
+    assert restored.elapsed_seconds() == 0
+
+
+def test_reuse_for_copies_result_for_new_request():
+    session = finished_session()
+    
+    copy = session.reuse_for(2, 'сколько будет 2+2')
+    
+    assert (copy.user_id, copy.question) == (2, 'сколько будет 2+2')
+    assert (copy.final_answer, copy.total_tokens) == ('4', 10)
+    assert copy.get_formatted_log() == session.get_formatted_log()
+    # Исходная сессия из кэша не меняется
+    assert (session.user_id, session.question) == (1, 'Сколько будет 2+2?')
+
+
+def test_to_json_skips_private_fields():
+    data = finished_session().to_json()
+    
+    assert b'_formatted' not in data
+    assert b'_started_monotonic' not in data
@@ -0,0 +1,27 @@
+"""
+Тесты разбора ответов OpenRouter
+"""
+from ai.openrouter_client import openrouter_client
+
+
+def test_extract_confidence_prefers_labelled_form():
+    # Процитированное "90% уверенности" не перебивает собственную оценку модели
+    content = 'Модель A пишет "90% уверенности", но это спорно.\nУверенность: 70%'
+    
+    assert openrouter_client._extract_confidence(content) == 70.0
+
+
+def test_extract_confidence_falls_back_to_number_first():
+    assert openrouter_client._extract_confidence('Ответ: 4. 85% confidence') == 85.0
+    assert openrouter_client._extract_confidence('Без оценки') is None
+
+
+def test_parse_retry_after():
+    parse = openrouter_client._parse_retry_after
+    
+    assert parse('5', 30) == 5.0
+    assert parse('-1', 30) == 0.0
+    # Слишком долгое ожидание ограничивается
+    assert parse('3600', 30) == 30
+    assert parse(None, 30) is None
+    assert parse('Wed, 21 Oct 2026 07:28:00 GMT', 30) is None
@@ -0,0 +1,69 @@
+"""
+Тесты ограничителя частоты запросов (время подменено)
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ai import rate_limiter
+from ai.rate_limiter import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Подменяемые монотонные часы; sleep сдвигает их и запоминает паузы"""
+    state = {'now': 0.0, 'sleeps': []}
+    
+    async def fake_sleep(seconds):
+        state['sleeps'].append(seconds)
+        state['now'] += seconds
+    
+    monkeypatch.setattr(rate_limiter, 'time', SimpleNamespace(monotonic=lambda: state['now']))
+    monkeypatch.setattr(rate_limiter, 'asyncio', SimpleNamespace(Lock=asyncio.Lock, sleep=fake_sleep))
+    return state
+
+
+@pytest.mark.asyncio
+async def test_burst_up_to_capacity_does_not_wait(clock):
+    limiter = RateLimiter(60)
+    
+    for _ in range(60):
+        await limiter.acquire()
+    
+    assert clock['sleeps'] == []
+
+
+@pytest.mark.asyncio
+async def test_empty_bucket_waits_for_refill(clock):
+    limiter = RateLimiter(60)  # один токен в секунду
+    for _ in range(60):
+        await limiter.acquire()
+    
+    await limiter.acquire()
+    
+    assert clock['sleeps'] == [pytest.approx(1.0)]
+
+
+@pytest.mark.asyncio
+async def test_tokens_refill_over_time(clock):
+    limiter = RateLimiter(60)
+    for _ in range(60):
+        await limiter.acquire()
+    
+    # За 10 секунд накопилось 10 токенов
+    clock['now'] += 10
+    for _ in range(10):
+        await limiter.acquire()
+    
+    assert clock['sleeps'] == []
+
+
+@pytest.mark.asyncio
+async def test_disabled_limiter_never_waits(clock):
+    limiter = RateLimiter(None)
+    
+    for _ in range(1000):
+        await limiter.acquire()
+    
+    assert clock['sleeps'] == []
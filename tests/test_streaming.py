@@ -0,0 +1,118 @@
+"""
+Тесты потоковых ответов на локальном SSE-сервере
+"""
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ai.cache import CachedClient
+from ai.openrouter_client import OpenRouterClient, StreamInterruptedError
+
+EVENTS = [
+    'data: {"choices": [{"delta": {"content": "Ответ "}}]}\n\n'.encode(),
+    'data: {"choices": [{"delta": {"content": "42. Уверенность: 90%"}}]}\n\n'.encode(),
+]
+USAGE = b'data: {"choices": [], "usage": {"total_tokens": 33}}\n\n'
+DONE = b'data: [DONE]\n\n'
+
+
+def sse_handler(body_events, drop=False):
+    async def handler(request):
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for event in body_events:
+            await response.write(event)
+        if drop:
+            # Обрыв соединения посреди ответа
+            request.transport.close()
+            return response
+        await response.write_eof()
+        return response
+    return handler
+
+
+@pytest_asyncio.fixture
+async def make_client():
+    servers = []
+    clients = []
+    
+    async def factory(handler):
+        app = web.Application()
+        app.router.add_post('/chat/completions', handler)
+        server = TestServer(app)
+        await server.start_server()
+        servers.append(server)
+        
+        client = OpenRouterClient()
+        client.base_url = str(server.make_url('')).rstrip('/')
+        clients.append(client)
+        return client
+    
+    yield factory
+    
+    for client in clients:
+        await client.close()
+    for server in servers:
+        await server.close()
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+@pytest.mark.asyncio
+async def test_complete_stream_reports_usage(make_client):
+    client = await make_client(sse_handler(EVENTS + [USAGE, DONE]))
+    usage = {}
+    
+    chunks = await collect(client.stream_response('claude', [{'role': 'user', 'content': 'q'}], usage=usage))
+    
+    assert ''.join(chunks) == 'Ответ 42. Уверенность: 90%'
+    assert usage['total_tokens'] == 33
+
+
+@pytest.mark.asyncio
+async def test_dropped_stream_raises(make_client):
+    client = await make_client(sse_handler(EVENTS, drop=True))
+    
+    with pytest.raises(StreamInterruptedError):
+        await collect(client.stream_response('claude', [{'role': 'user', 'content': 'q'}]))
+
+
+@pytest.mark.asyncio
+async def test_http_error_raises(make_client):
+    async def handler(request):
+        return web.Response(status=503, text='overloaded')
+    client = await make_client(handler)
+    
+    with pytest.raises(StreamInterruptedError):
+        await collect(client.stream_response('claude', [{'role': 'user', 'content': 'q'}]))
+
+
+@pytest.mark.asyncio
+async def test_interrupted_stream_is_not_cached(make_client):
+    client = await make_client(sse_handler(EVENTS, drop=True))
+    cached = CachedClient(client, max_temperature=1.0)
+    messages = [{'role': 'user', 'content': 'q'}]
+    
+    with pytest.raises(StreamInterruptedError):
+        await collect(cached.stream_response('claude', messages))
+    
+    assert cached.stats == {'hits': 0, 'misses': 1}
+    assert not cached._entries
+
+
+@pytest.mark.asyncio
+async def test_completed_stream_is_cached(make_client):
+    client = await make_client(sse_handler(EVENTS + [USAGE, DONE]))
+    cached = CachedClient(client, max_temperature=1.0)
+    messages = [{'role': 'user', 'content': 'q'}]
+    
+    await collect(cached.stream_response('claude', messages))
+    usage = {}
+    chunks = await collect(cached.stream_response('claude', messages, usage=usage))
+    
+    assert chunks == ['Ответ 42. Уверенность: 90%']
+    assert usage['total_tokens'] == 33
+    assert cached.stats == {'hits': 1, 'misses': 1}